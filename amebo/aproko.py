@@ -1,89 +1,182 @@
-from asyncio import gather, sleep
+from asyncio import create_task, sleep
 from datetime import datetime
 from http import HTTPStatus
 from sqlite3 import Connection, Cursor
+from time import perf_counter
+from typing import Optional
 
 # installed libs
 from heaven import Router
 from httpx import AsyncClient
-from orjson import loads
 
 # src code
-from amebo.constants.literals import DB
+from amebo.constants.literals import ACKS, BREAKERS, CLIENT, DB, ROUTES, SCHEDULER
 from amebo.decorators.providers import Executor
+from amebo.dispatch.acks import Acknowledger
+from amebo.dispatch.batches import ACCEPTED, acknowledged, envelope, fill
+from amebo.dispatch.breakers import Breakers, hostof
+from amebo.dispatch.queries import claimscript, pendingscript
+from amebo.dispatch.retries import backoff
+from amebo.dispatch.routes import Routes
+from amebo.dispatch.scheduler import Scheduler
+from amebo.utils.compression import decompress
+from amebo.utils.metrics import BACKLOG, DELIVERIES, DELIVERY_SECONDS, ENVELOPE_FILL
 
 
 async def aproko(router: Router):
     executor = Executor(router)
+    client: AsyncClient = router.peek(CLIENT)
+    scheduler: Scheduler = router.peek(SCHEDULER)
+    acks: Acknowledger = router.peek(ACKS)
+    routes: Routes = router.peek(ROUTES)
+    breakers: Breakers = router.peek(BREAKERS)
+    node, lease = router.CONFIG('node'), router.CONFIG('lease')
+    leasing = executor.engine.startswith('postgres')
     x = executor.schema
-    accepters = []
-    rejecters = []
+    backlog = {}  # claimed or fetched gists waiting for a free slot, in event order
 
     # Check if database is available
     if executor.db is None and executor.engine and executor.engine.startswith('postgres'):
         print("Warning: Database connection not available, aproko daemon will not run")
         return False
-    async def notify(endpoint: str, data: dict, secret: str, gist_id: int):
-        headers = {
-            'Content-Type': 'application/json',
-            'X-PASS-Phrase': secret
-        }
+    async def notify(subscription: int, endpoint: str, headers: dict, gists: list, batched: bool):
+        """
+        gists are (gist, payload, delay, exhausted, encoding), a batched subscription gets their payloads as one
+        array. a payload still compressed goes out as it is with its Content-Encoding
+        """
+        # a host that keeps failing is left alone for a while, its gists sleep until then without using a retry
+        host = hostof(endpoint)
+        if not breakers.allow(host):
+            DELIVERIES.inc(subscription, 'deferred', amount=len(gists))
+            for gist_id, *_ in gists: acks.defer(gist_id, breakers.wait(host))
+            return
 
-        client = None
+        body = envelope([payload for _, payload, *_ in gists]) if batched else gists[0][1]
+        if not batched and gists[0][4]: headers = {**headers, 'Content-Encoding': gists[0][4]}
+        accepted, started = [False] * len(gists), perf_counter()
         try:
-            client = AsyncClient()
-            result = await client.post(endpoint, json=data, headers=headers)
-            if result.status_code not in [HTTPStatus.ACCEPTED, HTTPStatus.OK]: rejecters.append(int(gist_id))
-            else: accepters.append(int(gist_id))
+            result = await client.post(endpoint, content=body, headers=headers)
+            status = result.status_code
+            if status in ACCEPTED: accepted = [True] * len(gists)
+            elif batched and status == HTTPStatus.MULTI_STATUS: accepted = acknowledged(result.content, len(gists))
+            # the host is up even if it turned these gists down, unless it says it is failing or overwhelmed
+            if status >= HTTPStatus.INTERNAL_SERVER_ERROR or status == HTTPStatus.TOO_MANY_REQUESTS: breakers.failed(host)
+            else: breakers.succeeded(host)
         except Exception as exc:
             print('Exception occured@@@@@@@@@@@@@@@@@@@@@@@@@: ', exc, ' ', endpoint)
-            rejecters.append(gist_id)
-        finally:
-            if client:
-                await client.aclose()
+            breakers.failed(host)
+        DELIVERY_SECONDS.observe(perf_counter() - started, subscription)
 
-        try:
-            rejections = str(tuple(rejecters)).replace(',)', ')')
-            sqls = f'''
-                UPDATE {x}gists SET retries = retries + 1 WHERE rowid IN {rejections};
-            '''
-            if rejecters: await executor.fetch(0).execute(sqls)
-        except Exception as exc: print('Could not negate in notify: ', exc)
+        # outcomes stream into the ack writer as deliveries finish and are written in batches, a rejected
+        # gist sleeps out its backoff so a failing subscriber stops taking slots and writes
+        for (gist_id, _, delay, exhausted, _), ok in zip(gists, accepted):
+            DELIVERIES.inc(subscription, 'delivered' if ok else 'exhausted' if exhausted else 'failed')
+            if ok: acks.accept(gist_id)
+            else: acks.reject(gist_id, delay, exhausted=exhausted)
 
-        try:
-            acceptances = str(tuple(accepters)).replace(',)', ')')
-            sqls = f'''
-                UPDATE {x}gists SET completed = 1, retries = retries + 1 WHERE rowid IN {acceptances};
-            '''
-            if accepters: await executor.fetch(0).execute(sqls)
-        except Exception as exc: print('Could not update in notify: ', exc)
+    async def claim():
+        # every node gets a disjoint batch, rows locked by another node's claim are skipped not waited on
+        # and leases of a crashed node lapse so its gists are claimed again
+        limit = scheduler.capacity - len(backlog)
+        if limit <= 0: return []
+        return await executor.fetch(2).execute(claimscript(x), node, limit, float(lease))
+
+    async def pending():
+        # gists still in flight or waiting come back from the query as pending so a full envelope is
+        # fetched on top of them, they are skipped when added to the backlog
+        limit = scheduler.capacity + scheduler.pending + len(backlog) + acks.waiting
+        return await executor.fetch(2).execute(pendingscript(x), datetime.now().isoformat(), limit)
 
     async def traverse():
+        scheduler.mark()
+        asked = scheduler.capacity - len(backlog) if leasing else scheduler.capacity
+        gists = await (claim() if leasing else pending()) or []
+        if asked > 0: ENVELOPE_FILL.observe(min(len(gists) / asked, 1))
+
+        # a subscription the routes have not seen yet means they missed a change, e.g. a lost notification
+        if any(routes.get(gist[1]) is None for gist in gists): routes.invalidate()
+        try: await routes.refresh(executor)
+        except Exception as exc: print('Could not refresh routes: ', exc)
+        return gists
+
+    async def renew():
+        # claimed gists may queue behind slow subscribers for longer than a lease, so keep ours alive. only
+        # those still held are renewed, one dropped from the backlog is claimed again once its lease lapses
+        while not scheduler.closed:
+            await sleep(lease / 3)
+            try:
+                await executor.fetch(0).execute(f'''
+                    UPDATE {x}gists SET lease_until = now() + make_interval(secs => $2)
+                        WHERE leased_by = $1 AND completed = 0 AND rowid = ANY($3::int[]);
+                ''', node, float(lease), [*backlog, *scheduler.submitted])
+            except Exception as exc: print('Could not renew leases: ', exc)
+
+    def deliverable(gist: tuple) -> Optional[tuple]:
+        """what notify needs of a fetched gist, none when it has no attempts left"""
+        gid, subscription, retries, payload, ordered, encoding = gist
+        route = routes.get(subscription)
+        if ordered: acks.lead(gid)
+        if retries >= route.max_retries:
+            # max_retries was lowered below the attempts this gist already had
+            acks.reject(gid, 0, exhausted=True)
+            return None
+        # compressed payloads are only passed on as they are to a handler taking them one at a time
+        if encoding and (route.batch[0] > 1 or not route.encoded):
+            try: payload, encoding = decompress(encoding, payload), None
+            except Exception as exc:
+                # only this gist waits, as long as the longest backoff and without using up a retry, e.g.
+                # for a node that has zstandard to claim it
+                print(f'Could not decompress gist {gid}: ', exc)
+                acks.defer(gid, max(route.policy[2], 1))
+                return None
+        return gid, payload, backoff(retries, *route.policy), retries + 1 >= route.max_retries, encoding
+
+    def dispatch(gists: list) -> int:
+        # a claim locks and rechecks every row it returns so it never sees an outcome already written,
+        # only polled gists can be stale and skipping a claimed one would strand it under our lease
+        busy = scheduler.running if leasing else scheduler.busy
+        for gist in gists:
+            if not busy(gist[0]) and not acks.holds(gist[0]): backlog.setdefault(gist[0], gist)
+
+        submitted = 0
+        while backlog and scheduler.vacancies:
+            gist = backlog.pop(next(iter(backlog)))
+            subscription, route = gist[1], routes.get(gist[1])
+            if route is None: continue  # left pending, or to its lease, until the routes catch up
+            first = deliverable(gist)
+            if first is None: continue
+            size, limit = route.batch
+            batched = size > 1
+            gists = [first]
+            if batched: gists = fill(backlog, subscription, first, min(size, scheduler.vacancies), limit, deliverable)
+            job = lambda s=subscription, r=route, g=gists, b=batched: notify(s, r.endpoint, r.headers, g, b)
+            submitted += scheduler.submit(
+                tuple(gid for gid, *_ in gists), subscription, route.concurrency, route.endpoint, job)
+        return submitted
+
+    # the next envelope is fetched while the current one is still being delivered, and every delivery
+    # writes its own outcome as it completes, so a free slot is refilled without a fetch round trip
+    renewal = create_task(renew()) if leasing else None
+    writer = create_task(acks.run())
+    prefetch = create_task(traverse())
+    while not scheduler.closed:
         try:
-            gists = await executor.fetch(2).execute(f'''
-                SELECT
-                    s.handler AS endpoint, e.payload, a.secret, g.rowid as gid
-                FROM {x}gists AS g JOIN {x}events e ON
-                    g.event = e.event
-                JOIN {x}subscriptions s ON
-                    s.subscription = g.subscription
-                JOIN {x}actions x ON
-                    e.action = x.action
-                JOIN {x}applications a ON
-                    s.application = a.application
-                WHERE g.completed <> 1
-                AND g.retries < s.max_retries
-                AND (g.sleep_until IS NULL OR g.sleep_until < '{datetime.now().isoformat()}'::timestamp)
-                ORDER BY g.event LIMIT {router.CONFIG('envelope_size')};
-            ''')
-
-            if gists is None:
-                gists = []
-            if len(gists) < router.CONFIG('rest_when'): await sleep(router.CONFIG('idles'))
-            await gather(*[notify(endpoint, loads(payload), secret, gid) for endpoint, payload, secret, gid in gists])
-        except Exception as exc: print('Exception occured: ', exc)
-    await traverse()
-    return True
+            await scheduler.vacancy()
+            gists = await prefetch
+            prefetch = None
+            submitted = dispatch(gists)
+            BACKLOG.set(len(backlog))
+            if not backlog and submitted < max(router.CONFIG('rest_when'), 1):
+                await scheduler.idle(router.CONFIG('idles'))
+        except Exception as exc:
+            print('Exception occured: ', exc)
+            await scheduler.idle(router.CONFIG('idles'))
+        if not scheduler.closed: prefetch = create_task(traverse())
+
+    if prefetch: prefetch.cancel()
+    if renewal: renewal.cancel()
+    writer.cancel()
+    return False
 
 
 def cli():
@@ -0,0 +1,203 @@
+"""
+Load generator for a running amebo or cluster of them, installed as `amebo-bench`. Registers the
+applications, actions and subscriptions of a spec, then publishes events at a target rate with an open
+loop: events are sent when their arrival is due whether or not earlier ones have been answered, and their
+latency counts from when they were due, so a slow server shows up as latency rather than a lower rate.
+
+    amebo-bench --target http://localhost:3310 --spec spec.json --action user.created --rate 500 --duration 60
+    amebo-bench --target http://a:3310,http://b:3310 --events events.jsonl --rate 2000 --arrivals uniform
+
+Events are replayed from a file of json lines, each an event as posted to /v1/events or just a payload for
+--action, or made up from the json schema --action was registered with.
+"""
+from argparse import ArgumentParser, Namespace
+from asyncio import create_task, gather, run, sleep
+from datetime import datetime
+from itertools import count, cycle
+from pathlib import Path
+from random import Random
+from time import perf_counter
+from typing import Dict, Iterator, List
+from uuid import uuid4
+
+from httpx import AsyncClient, Limits
+from orjson import dumps, loads, OPT_INDENT_2
+
+import amebo
+from amebo.bench.payloads import synthesize
+from amebo.bench.stats import histogram, rate, summary
+
+
+SECTIONS = (('applications', '/v1/applications'), ('actions', '/v1/actions'), ('subscriptions', '/v1/subscriptions'))
+
+
+async def register(client: AsyncClient, target: str, spec: dict) -> Dict[str, Dict[str, int]]:
+    """posts every section of the spec in order, what already exists is turned down and counted as such"""
+    outcomes = {}
+    for section, path in SECTIONS:
+        for body in spec.get(section) or []:
+            response = await client.post(f'{target}{path}', json=body)
+            status = 'created' if response.status_code < 300 else str(response.status_code)
+            outcomes.setdefault(section, {})
+            outcomes[section][status] = outcomes[section].get(status, 0) + 1
+    return outcomes
+
+
+async def schema(client: AsyncClient, target: str, action: str) -> dict:
+    response = await client.get(f'{target}/v1/actions', params={'action': action})
+    for found in response.json() if response.status_code == 200 else []:
+        if found.get('action') == action: return found['schemata']
+    raise SystemExit(f'action {action} is not registered at {target}')
+
+
+def replayed(path: Path, args: Namespace) -> Iterator[dict]:
+    """events of the file, from the top again with --repeat, dedupers made unique to this run"""
+    tag = uuid4().hex[:8]
+    for lap in count() if args.repeat else range(1):
+        with path.open('rb') as lines:
+            for number, line in enumerate(lines):
+                if not line.strip(): continue
+                event = loads(line)
+                if 'payload' not in event: event = {'action': args.action, 'payload': event}
+                yield {
+                    'secret': args.secret,
+                    'sleep_until': None,
+                    **event,
+                    'deduper': f"{event.get('deduper') or number}-{tag}-{lap}",
+                }
+
+
+def synthesized(schemata: dict, args: Namespace) -> Iterator[dict]:
+    random, tag = Random(args.seed), uuid4().hex[:8]
+    for number in count():
+        yield {
+            'action': args.action,
+            'secret': args.secret,
+            'deduper': f'{tag}-{number}',
+            'sleep_until': None,
+            'payload': synthesize(schemata, random),
+        }
+
+
+async def drive(client: AsyncClient, targets: List[str], events: Iterator[dict], args: Namespace) -> dict:
+    random = Random(args.seed)
+    def gap() -> float:
+        return random.expovariate(args.rate) if args.arrivals == 'poisson' else 1 / args.rate
+
+    latencies, outcomes, pending = [], {}, set()
+    lag, shed = 0.0, 0
+    async def publish(target: str, event: dict, due: float):
+        try:
+            response = await client.post(f'{target}/v1/events', content=dumps(event), headers={
+                'Content-Type': 'application/json'})
+            outcome = str(response.status_code)
+        except Exception as exc: outcome = type(exc).__name__
+        latencies.append(perf_counter() - due)
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    started = due = perf_counter()
+    sent, targeted = 0, cycle(targets)
+    for event in events:
+        if args.count and sent + shed >= args.count: break
+        if args.duration and due - started >= args.duration: break
+        wait = due - perf_counter()
+        if wait > 0: await sleep(wait)
+        else: lag = max(lag, -wait)
+        if len(pending) >= args.max_inflight: shed += 1  # an open loop does not wait for the server, it gives up
+        else:
+            task = create_task(publish(next(targeted), event, due))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+            sent += 1
+        due += gap()
+    offered = max(due, perf_counter()) - started  # the schedule asked for, or longer when it fell behind
+    await gather(*pending)
+    elapsed = perf_counter() - started
+
+    succeeded = sum(total for outcome, total in outcomes.items() if outcome.startswith('2'))
+    return {
+        'targets': targets,
+        'rate': args.rate,
+        'arrivals': args.arrivals,
+        'sent': sent,
+        'shed': shed,
+        'succeeded': succeeded,
+        'seconds': round(elapsed, 3),
+        'offered_rate': rate(sent, offered),
+        'achieved_rate': rate(succeeded, elapsed),
+        'max_lag_ms': round(lag * 1000, 3),
+        'outcomes': dict(sorted(outcomes.items())),
+        'latency_ms': summary(latencies),
+        'histogram': dict(histogram(latencies)),
+    }
+
+
+def report(results: dict) -> str:
+    lines = [
+        f"sent {results['sent']} at {results['offered_rate']}/s of {results['rate']}/s asked for, "
+        f"{results['succeeded']} succeeded at {results['achieved_rate']}/s, {results['shed']} shed",
+        'outcomes ' + ', '.join(f'{outcome}: {total}' for outcome, total in results['outcomes'].items()),
+        'latency  ' + ', '.join(f'{name} {value}ms' for name, value in results['latency_ms'].items() if name != 'count'),
+    ]
+    most = max(results['histogram'].values(), default=0) or 1
+    for bound, total in results['histogram'].items():
+        lines.append(f"  <= {bound + ('' if bound == '+Inf' else 's'):>7} {total:>8} {'#' * round(40 * total / most)}")
+    return '\n'.join(lines)
+
+
+def parser() -> ArgumentParser:
+    options = ArgumentParser(prog='amebo-bench', description=__doc__.split('\n\n')[0].strip())
+    options.add_argument('--target', required=True, help='amebo url, comma separated to spread events over nodes')
+    options.add_argument('--spec', type=Path, help='json of applications, actions and subscriptions to register')
+    options.add_argument('--events', type=Path, help='json lines of events or payloads to replay')
+    options.add_argument('--repeat', action='store_true', help='replay the events file until the run is over')
+    options.add_argument('--action', help='action of payloads without one, made up from its schema without --events')
+    options.add_argument('--secret', default='', help='secret sent with events that have none')
+    options.add_argument('--token', help='bearer token sent with every request')
+    options.add_argument('--rate', type=float, default=100, help='events per second asked for')
+    options.add_argument('--arrivals', choices=('poisson', 'uniform'), default='poisson')
+    options.add_argument('--duration', type=float, default=0, help='seconds to publish for')
+    options.add_argument('--count', type=int, default=0, help='events to publish, at most')
+    options.add_argument('--max-inflight', type=int, default=1000, help='requests in flight before events are shed')
+    options.add_argument('--timeout', type=float, default=30, help='seconds to wait on a request')
+    options.add_argument('--seed', type=int, help='for arrivals and made up payloads')
+    options.add_argument('--output', type=Path, help='json file the results are written to')
+    return options
+
+
+async def main(args: Namespace) -> dict:
+    targets = [target.strip().rstrip('/') for target in args.target.split(',') if target.strip()]
+    if args.rate <= 0: raise SystemExit('--rate must be above 0')
+    if not (args.duration or args.count or args.events and not args.repeat):
+        raise SystemExit('give --duration or --count to bound the run')
+    if not (args.events or args.action): raise SystemExit('give --events to replay or --action to make up payloads')
+
+    started = datetime.now().isoformat(timespec='seconds')
+    headers = {'Authorization': f'Bearer {args.token}'} if args.token else {}
+    limits = Limits(max_connections=args.max_inflight, max_keepalive_connections=min(args.max_inflight, 100))
+    async with AsyncClient(timeout=args.timeout, limits=limits, headers=headers) as client:
+        registered = await register(client, targets[0], loads(args.spec.read_bytes())) if args.spec else {}
+        if args.events: events = replayed(args.events, args)
+        else: events = synthesized(await schema(client, targets[0], args.action), args)
+        results = await drive(client, targets, events, args)
+
+    return {
+        'amebo': amebo.__version__,
+        'started': started,
+        'registered': registered,
+        **results,
+    }
+
+
+def execute():
+    args = parser().parse_args()
+    results = run(main(args))
+    print(report(results))
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_bytes(dumps(results, option=OPT_INDENT_2))
+        print(f'results written to {args.output}')
+
+
+if __name__ == '__main__':
+    execute()
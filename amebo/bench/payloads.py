@@ -0,0 +1,61 @@
+"""
+Payloads made up from an action's json schema, enough of draft 7 for the schemas actions are registered
+with: types, properties and required, enum and const, string formats and lengths, numeric bounds, array
+sizes, and the first choice of anyOf, oneOf or allOf. Anything else gets a value of the right type.
+"""
+from datetime import datetime, timedelta
+from random import Random
+from string import ascii_lowercase
+from typing import Any
+from uuid import UUID
+
+
+FORMATS = {
+    'date': lambda r: (datetime(2024, 1, 1) + timedelta(days=r.randrange(3650))).date().isoformat(),
+    'date-time': lambda r: (datetime(2024, 1, 1) + timedelta(seconds=r.randrange(315_360_000))).isoformat() + 'Z',
+    'email': lambda r: f'{_word(r, 8)}@example.com',
+    'hostname': lambda r: f'{_word(r, 8)}.example.com',
+    'ipv4': lambda r: '.'.join(str(r.randrange(1, 255)) for _ in range(4)),
+    'uri': lambda r: f'https://example.com/{_word(r, 8)}',
+    'uuid': lambda r: str(UUID(int=r.getrandbits(128), version=4)),
+}
+
+
+def _word(random: Random, length: int) -> str:
+    return ''.join(random.choice(ascii_lowercase) for _ in range(length))
+
+
+def synthesize(schema: Any, random: Random, depth: int = 0) -> Any:
+    """a value that should pass `schema`, optional properties are included half of the time"""
+    if not isinstance(schema, dict) or depth > 16: return None
+    if 'const' in schema: return schema['const']
+    if schema.get('enum'): return random.choice(schema['enum'])
+    for choice in ('allOf', 'anyOf', 'oneOf'):
+        if schema.get(choice): return synthesize({**schema[choice][0], **{
+            key: value for key, value in schema.items() if key != choice}}, random, depth + 1)
+
+    kind = schema.get('type')
+    if isinstance(kind, list): kind = next((k for k in kind if k != 'null'), 'null')
+    if kind is None: kind = 'object' if 'properties' in schema else 'string'
+
+    if kind == 'object':
+        required = set(schema.get('required') or ())
+        return {
+            name: synthesize(subschema, random, depth + 1)
+            for name, subschema in (schema.get('properties') or {}).items()
+            if name in required or random.random() < 0.5
+        }
+    if kind == 'array':
+        least = schema.get('minItems', 1)
+        most = max(schema.get('maxItems', least + 3), least)
+        return [synthesize(schema.get('items') or {}, random, depth + 1) for _ in range(random.randint(least, most))]
+    if kind in ('integer', 'number'):
+        least, most = schema.get('minimum', 0), schema.get('maximum', 1_000_000)
+        if kind == 'integer': return random.randint(int(least), int(most))
+        return round(random.uniform(least, most), 4)
+    if kind == 'boolean': return random.random() < 0.5
+    if kind == 'null': return None
+
+    if schema.get('format') in FORMATS: return FORMATS[schema['format']](random)
+    least = schema.get('minLength', 1)
+    return _word(random, random.randint(least, max(schema.get('maxLength', least + 15), least)))
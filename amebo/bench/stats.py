@@ -0,0 +1,38 @@
+from bisect import bisect_left
+from math import ceil
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from amebo.utils.metrics import LATENCIES
+
+
+def percentile(samples: Sequence[float], p: float) -> Optional[float]:
+    """nearest rank percentile of sorted samples, p from 0 to 100"""
+    if not samples: return None
+    return samples[max(ceil(p / 100 * len(samples)) - 1, 0)]
+
+
+def summary(samples: Sequence[float]) -> Dict[str, Optional[float]]:
+    """samples in seconds, summarised in milliseconds"""
+    ordered = sorted(samples)
+    def ms(value: Optional[float]) -> Optional[float]:
+        return None if value is None else round(value * 1000, 3)
+    return {
+        'count': len(ordered),
+        'mean': ms(sum(ordered) / len(ordered) if ordered else None),
+        'min': ms(ordered[0] if ordered else None),
+        'p50': ms(percentile(ordered, 50)),
+        'p90': ms(percentile(ordered, 90)),
+        'p99': ms(percentile(ordered, 99)),
+        'max': ms(ordered[-1] if ordered else None),
+    }
+
+
+def rate(count: int, seconds: float) -> Optional[float]:
+    return round(count / seconds, 1) if seconds > 0 else None
+
+
+def histogram(samples: Sequence[float], buckets: Tuple[float, ...] = LATENCIES) -> List[Tuple[str, int]]:
+    """samples per bucket as labelled by its upper bound in seconds, not cumulative, the last one is +Inf"""
+    counts = [0] * (len(buckets) + 1)
+    for sample in samples: counts[bisect_left(buckets, sample)] += 1
+    return list(zip([*map(str, buckets), '+Inf'], counts))
@@ -0,0 +1,87 @@
+"""
+Stub subscribers for benchmarks, plain asyncio http servers that answer a delivery after `latency` seconds
+and turn down a `failures` fraction of them with a 503. Payloads carrying `i` (their number) and `t` (epoch
+seconds when published) are timed where they land, so latency is measured end to end.
+"""
+from asyncio import IncompleteReadError, StreamReader, StreamWriter, sleep, start_server
+from json import loads
+from random import Random
+from time import time
+from typing import Dict, Optional, Set
+
+from amebo.utils.compression import decompress
+
+
+OK = b'HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n'
+UNAVAILABLE = b'HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\n\r\n'
+
+
+class Stub(object):
+    def __init__(self, latency: float = 0, failures: float = 0, seed: Optional[int] = None):
+        self.latency = latency
+        self.failures = failures
+        self._random = Random(seed)
+        self._server = None
+        self._writers: Set[StreamWriter] = set()
+        self.reset()
+
+    def reset(self):
+        self.requests = 0  # retries and batches included
+        self.failed = 0
+        self.latencies: Dict[int, float] = {}  # seconds from publishing to the first accepted delivery of each event
+        self.last: Optional[float] = None
+
+    @property
+    def delivered(self) -> int:
+        return len(self.latencies)
+
+    @property
+    def port(self) -> int:
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> 'Stub':
+        self._server = await start_server(self._serve, host, port)
+        return self
+
+    async def stop(self):
+        if self._server is None: return
+        self._server.close()
+        for writer in list(self._writers): writer.close()  # idle keep alive connections would hold their handlers
+        await self._server.wait_closed()
+        await sleep(0)
+
+    async def _serve(self, reader: StreamReader, writer: StreamWriter):
+        # connections are kept alive as amebo pools them, one request after the other
+        self._writers.add(writer)
+        try:
+            while True:
+                try: head = await reader.readuntil(b'\r\n\r\n')
+                except (IncompleteReadError, ConnectionError): break
+                headers = {}
+                for line in head.split(b'\r\n')[1:]:
+                    name, _, value = line.partition(b':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get(b'content-length') or 0))
+                writer.write(await self._answer(body, headers.get(b'content-encoding')))
+                await writer.drain()
+                if headers.get(b'connection', b'').lower() == b'close': break
+        except ConnectionError: pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _answer(self, body: bytes, encoding: Optional[bytes]) -> bytes:
+        self.requests += 1
+        if self.latency: await sleep(self.latency)
+        if self.failures and self._random.random() < self.failures:
+            self.failed += 1
+            return UNAVAILABLE
+
+        now = time()
+        try: payloads = loads(decompress(encoding.decode(), body) if encoding else body)
+        except ValueError: payloads = None
+        for payload in payloads if isinstance(payloads, list) else [payloads]:
+            if not isinstance(payload, dict) or 'i' not in payload: continue
+            self.latencies.setdefault(payload['i'], now - payload.get('t', now))
+        self.last = now
+        return OK
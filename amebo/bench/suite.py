@@ -0,0 +1,294 @@
+"""
+End to end benchmark. Boots amebo against sqlite and/or postgres with stub subscribers answering after a
+set latency and failing a set share of deliveries, publishes events one at a time and then concurrently,
+and waits for every one of them to be delivered. Ingest rate, delivery rate, end to end latency and the
+size of the database are written as json so releases can be compared.
+
+    python -m amebo.bench.suite --engines sqlite,postgres --dsn postgresql://localhost/scratch
+
+The postgres database is a scratch one, its _amebo_ schema is dropped before every run.
+"""
+from argparse import ArgumentParser, Namespace
+from asyncio import gather, run, Semaphore, sleep
+from datetime import datetime
+from os import environ, pathsep
+from pathlib import Path
+from platform import platform, python_version
+from socket import socket
+from subprocess import DEVNULL, Popen, STDOUT, TimeoutExpired, check_output
+from sys import executable
+from tempfile import TemporaryDirectory
+from time import perf_counter, time
+from typing import Dict, List, Optional
+
+from httpx import AsyncClient, Limits
+from orjson import dumps, OPT_INDENT_2
+
+import amebo
+from amebo.bench.stats import rate, summary
+from amebo.bench.stubs import Stub
+
+
+ACTION = 'bench.happened'
+SECRET = 'benchmark-secret-0001'
+ROOT = Path(amebo.__file__).resolve().parent.parent
+
+
+def _port() -> int:
+    with socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _commit() -> Optional[str]:
+    try: return check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, stderr=DEVNULL).decode().strip()
+    except Exception: return None
+
+
+class Server(object):
+    """an amebo process of its own so the benchmark never shares its event loop"""
+    def __init__(self, engine: str, dsn: Optional[str], workdir: str, env: Dict[str, str]):
+        self.engine = engine
+        self.dsn = dsn
+        self.workdir = Path(workdir)
+        self.port = _port()
+        self.url = f'http://127.0.0.1:{self.port}'
+        self.env = {
+            **environ,
+            'PYTHONPATH': pathsep.join(filter(None, [str(ROOT), environ.get('PYTHONPATH')])),
+            'AMEBO_SECRET': SECRET,
+            'AMEBO_USERNAME': 'bench',
+            'AMEBO_PASSWORD': 'bench',
+            **env,
+        }
+        if dsn: self.env['AMEBO_DSN'] = dsn
+        else: self.env.pop('AMEBO_DSN', None)
+        self._process: Optional[Popen] = None
+        self._log = None
+
+    async def reset(self):
+        if not self.dsn: return  # sqlite starts from an empty work directory
+        from asyncpg import connect
+        conn = await connect(self.dsn)
+        try: await conn.execute('DROP SCHEMA IF EXISTS _amebo_ CASCADE')
+        finally: await conn.close()
+
+    async def start(self, client: AsyncClient, timeout: float = 30):
+        await self.reset()
+        self._log = open(self.workdir / 'amebo.log', 'wb')
+        self._process = Popen(
+            [executable, '-m', 'uvicorn', 'amebo.router:router', '--port', str(self.port), '--log-level', 'warning'],
+            cwd=self.workdir, env=self.env, stdout=self._log, stderr=STDOUT)
+        deadline = perf_counter() + timeout
+        while perf_counter() < deadline:
+            if self._process.poll() is not None: break
+            try:
+                if (await client.get(f'{self.url}/metrics')).status_code == 200: return
+            except Exception: pass
+            await sleep(0.2)
+        self.stop()
+        raise RuntimeError(f'amebo did not start, see {self.workdir / "amebo.log"}:\n{self.tail()}')
+
+    def tail(self, lines: int = 20) -> str:
+        try: return '\n'.join((self.workdir / 'amebo.log').read_text(errors='replace').splitlines()[-lines:])
+        except OSError: return ''
+
+    def stop(self):
+        if self._process and self._process.poll() is None:
+            self._process.terminate()
+            try: self._process.wait(15)
+            except TimeoutExpired: self._process.kill()
+        if self._log: self._log.close()
+
+    async def size(self) -> int:
+        """bytes taken by amebo's tables and indexes, or by the sqlite files including the wal"""
+        if not self.dsn: return sum(path.stat().st_size for path in self.workdir.glob('amebo.db*'))
+        from asyncpg import connect
+        conn = await connect(self.dsn)
+        try:
+            return await conn.fetchval('''
+                SELECT COALESCE(sum(pg_total_relation_size(c.oid)), 0)::bigint FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = '_amebo_' AND c.relkind IN ('r', 'm');
+            ''')
+        finally: await conn.close()
+
+
+async def register(client: AsyncClient, url: str, stubs: List[Stub], args: Namespace):
+    """an application per stub as an application has one address, each subscribed to the action"""
+    async def post(path: str, body: dict):
+        response = await client.post(f'{url}{path}', json=body)
+        if response.status_code >= 400: raise RuntimeError(f'{path} answered {response.status_code}: {response.text}')
+
+    for index, stub in enumerate(stubs):
+        await post('/v1/applications', {
+            'application': f'bench{index}', 'address': f'http://127.0.0.1:{stub.port}', 'secret': SECRET})
+    action = {'action': ACTION, 'application': 'bench0', 'secret': SECRET, 'schemata': {'type': 'object'}}
+    if args.compression: action['compression'] = args.compression
+    await post('/v1/actions', action)
+    for index, _ in enumerate(stubs):
+        await post('/v1/subscriptions', {
+            'application': f'bench{index}',
+            'action': ACTION,
+            'handler': '/hook',
+            'secret': SECRET,
+            'max_retries': args.retries,
+            'backoff_base': args.backoff,
+            'backoff_jitter': 0,
+            'batch_size': args.deliver_batch,
+        })
+
+
+async def phase(client: AsyncClient, url: str, stubs: List[Stub], first: int, count: int, concurrency: int, args: Namespace) -> dict:
+    """publishes `count` events numbered from `first` and waits for them to reach every stub"""
+    for stub in stubs: stub.reset()
+    padding = 'x' * args.payload_bytes
+    latencies, outcomes = [], {}
+    gate = Semaphore(concurrency)
+
+    async def publish(number: int):
+        async with gate:
+            started = perf_counter()
+            try:
+                response = await client.post(f'{url}/v1/events', json={
+                    'action': ACTION,
+                    'secret': SECRET,
+                    'deduper': f'bench-{number}',
+                    'sleep_until': None,
+                    'payload': {'i': number, 't': time(), 'padding': padding},
+                })
+                outcome = str(response.status_code)
+            except Exception as exc: outcome = type(exc).__name__
+            latencies.append(perf_counter() - started)
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    began = time()
+    await gather(*[publish(number) for number in range(first, first + count)])
+    ingested = time() - began
+    accepted = outcomes.get('201', 0)
+
+    # every accepted event goes to every stub, or drain gives up
+    expected, deadline = accepted * len(stubs), perf_counter() + args.drain
+    while sum(stub.delivered for stub in stubs) < expected and perf_counter() < deadline: await sleep(0.05)
+    delivered = sum(stub.delivered for stub in stubs)
+    last = max((stub.last for stub in stubs if stub.last), default=began)
+
+    return {
+        'events': count,
+        'concurrency': concurrency,
+        'ingest': {
+            'accepted': accepted,
+            'outcomes': outcomes,
+            'seconds': round(ingested, 3),
+            'rate': rate(accepted, ingested),
+            'latency_ms': summary(latencies),
+        },
+        'delivery': {
+            'expected': expected,
+            'delivered': delivered,
+            'requests': sum(stub.requests for stub in stubs),
+            'failed': sum(stub.failed for stub in stubs),
+            'seconds': round(last - began, 3),
+            'rate': rate(delivered, last - began),
+            'latency_ms': summary([latency for stub in stubs for latency in stub.latencies.values()]),
+        },
+    }
+
+
+async def bench(engine: str, args: Namespace) -> dict:
+    dsn = args.dsn if engine == 'postgres' else None
+    env = dict(pair.split('=', 1) for pair in args.env)
+    stubs = [await Stub(args.latency / 1000, args.failures, seed).start() for seed in range(args.subscribers)]
+    limits = Limits(max_connections=max(args.concurrency, 1), max_keepalive_connections=max(args.concurrency, 1))
+    with TemporaryDirectory(prefix='amebo-bench-') as workdir:
+        server = Server(engine, dsn, workdir, env)
+        try:
+            async with AsyncClient(timeout=60, limits=limits) as client:
+                await server.start(client)
+                await register(client, server.url, stubs, args)
+                phases = {}
+                if args.singles: phases['single'] = await phase(client, server.url, stubs, 0, args.singles, 1, args)
+                if args.events:
+                    phases['concurrent'] = await phase(
+                        client, server.url, stubs, args.singles, args.events, args.concurrency, args)
+                size = await server.size()
+        finally:
+            server.stop()
+            for stub in stubs: await stub.stop()
+
+    stored = sum(result['ingest']['accepted'] for result in phases.values())
+    return {
+        'engine': engine,
+        'phases': phases,
+        'database_bytes': size,
+        'bytes_per_event': round(size / stored, 1) if stored else None,
+    }
+
+
+def report(results: dict) -> str:
+    lines = [f"amebo {results['amebo']} ({results['commit'] or 'unknown commit'})"]
+    for run in results['runs']:
+        for name, result in run['phases'].items():
+            ingest, delivery = result['ingest'], result['delivery']
+            lines.append(
+                f"{run['engine']:<9} {name:<10} ingest {ingest['rate'] or 0:>9.1f}/s  "
+                f"delivery {delivery['rate'] or 0:>9.1f}/s  "
+                f"p50 {delivery['latency_ms']['p50'] or 0:>8.1f}ms  p99 {delivery['latency_ms']['p99'] or 0:>8.1f}ms  "
+                f"delivered {delivery['delivered']}/{delivery['expected']}")
+        lines.append(f"{run['engine']:<9} database   {run['database_bytes']} bytes, {run['bytes_per_event']} per event")
+    return '\n'.join(lines)
+
+
+def parser() -> ArgumentParser:
+    options = ArgumentParser(prog='python -m amebo.bench.suite', description=__doc__.split('\n\n')[0].strip())
+    options.add_argument('--engines', default='sqlite', help='comma separated, sqlite and/or postgres')
+    options.add_argument('--dsn', default=environ.get('AMEBO_BENCH_DSN'), help='scratch postgres database')
+    options.add_argument('--events', type=int, default=5000, help='events published concurrently')
+    options.add_argument('--singles', type=int, default=500, help='events published one at a time first')
+    options.add_argument('--concurrency', type=int, default=64, help='requests in flight while publishing')
+    options.add_argument('--payload-bytes', type=int, default=256, help='padding added to every payload')
+    options.add_argument('--subscribers', type=int, default=1, help='stub subscribers, each gets every event')
+    options.add_argument('--latency', type=float, default=0, help='milliseconds a stub takes to answer')
+    options.add_argument('--failures', type=float, default=0, help='share of deliveries a stub turns down')
+    options.add_argument('--retries', type=int, default=10, help='max_retries of the subscriptions')
+    options.add_argument('--backoff', type=float, default=0.1, help='backoff_base of the subscriptions')
+    options.add_argument('--deliver-batch', type=int, default=1, help='batch_size of the subscriptions')
+    options.add_argument('--compression', choices=('gzip', 'zstd'), help='compression of the action')
+    options.add_argument('--drain', type=float, default=120, help='seconds to wait for deliveries')
+    options.add_argument('--env', action='append', default=[], metavar='KEY=VALUE', help='amebo setting')
+    options.add_argument('--output', help='json file, benchmarks/amebo-<version>-<time>.json by default')
+    return options
+
+
+async def main(args: Namespace) -> dict:
+    engines = [engine.strip() for engine in args.engines.split(',') if engine.strip()]
+    for engine in engines:
+        if engine not in ('sqlite', 'postgres'): raise SystemExit(f'unknown engine {engine}')
+        if engine == 'postgres' and not args.dsn: raise SystemExit('postgres needs --dsn or AMEBO_BENCH_DSN')
+
+    settings = {key: value for key, value in vars(args).items() if key not in ('dsn', 'output')}
+    results = {
+        'amebo': amebo.__version__,
+        'commit': _commit(),
+        'python': python_version(),
+        'platform': platform(),
+        'started': datetime.now().isoformat(timespec='seconds'),
+        'settings': settings,
+        'runs': [],
+    }
+    for engine in engines: results['runs'].append(await bench(engine, args))
+    return results
+
+
+def execute():
+    args = parser().parse_args()
+    results = run(main(args))
+    output = Path(args.output or f"benchmarks/amebo-{results['amebo']}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_bytes(dumps(results, option=OPT_INDENT_2))
+    print(report(results))
+    print(f'results written to {output}')
+
+
+if __name__ == '__main__':
+    execute()
@@ -1,11 +1,48 @@
+ACKS = 'acks'
+
+ACTIONS_CHANNEL = 'amebo_actions'  # notified with the action whenever its schemata changes
+
+ARCHIVER = 'archiver'
+
+BREAKERS = 'breakers'
+
+CLIENT = 'client'
+
+CREATED, DUPLICATE, INVALID = 'created', 'duplicate', 'invalid'  # outcome of each event in a batch
+
+CURSOR_HEADER = 'X-Next-Cursor'  # where the next page of a listing starts
+
 DB = 'db'
+
+JSON_HEADERS = {'Content-Type': 'application/json'}  # payloads are stored and forwarded as json text
+
+GISTS_CHANNEL = 'amebo_gists'  # notified whenever new gists are ready for delivery
+
+LISTENER = 'listener'
+
 DEFAULT_PAGINATION = 15
 
 MAX_PAGINATION = 100
 
+NDJSON = 'application/x-ndjson'
+
+PASS_HEADER = 'X-PASS-Phrase'
+
 PG = 'pg'
 
 REDIS = 'redis'
 
+RETENTION = 'retention'
+
+ROUTES = 'routes'
+
+ROUTES_CHANNEL = 'amebo_routes'  # notified whenever subscriptions or applications change
+
+SCHEDULER = 'scheduler'
+
+SCHEMATAS = 'schematas'
+
 AMEBO_SECRET = 'AMEBO_SECRET'
 SQLITE = 'sqlite'
+
+WARNING_HEADER = 'X-Amebo-Warning'  # something the client should know the response leaves out
@@ -1,7 +1,6 @@
 initdbscript = '''
 BEGIN;
     DROP TABLE IF EXISTS credentials;
-    DROP TABLE IF EXISTS gists;
 
     CREATE TABLE IF NOT EXISTS credentials(
         username text primary key,
@@ -19,6 +18,7 @@ BEGIN;
         action text primary key,
         application text NOT NULL REFERENCES applications(application),
         schemata text NOT NULL,
+        compression text,  -- gzip or zstd to store large payloads of the action compressed, null for never
         timestamped text NOT NULL
     );
 
@@ -28,15 +28,32 @@ BEGIN;
         deduper text NOT NULL,
         payload text NOT NULL,
         timestamped text NOT NULL,
-
-        UNIQUE(deduper, payload)
+        ordering_key text,  -- events sharing a key are delivered to each subscription one at a time in order
+        encoding text,  -- how packed is compressed, payload only holds the digest when it is set
+        packed blob  -- the compressed payload
     );
 
+    -- duplicate events are caught by a fixed width digest of their deduper and payload rather than an index
+    -- over the payload itself, a digest is held until it expires and then taken by the next event with it
+    CREATE TABLE IF NOT EXISTS dedupes (
+        digest blob primary key,
+        expires text,  -- null holds it for as long as events are kept
+        timestamped text NOT NULL
+    ) WITHOUT ROWID;
+
     CREATE TABLE IF NOT EXISTS subscriptions (
         subscription integer primary key NOT NULL,  -- autogenerated for ease
         application text NOT NULL references applications(application),  -- subscribing app i.e. producer
         action text NOT NULL references actions(action),
         max_retries integer not null default 3,
+        max_concurrency integer,  -- concurrent deliveries allowed to the handler, null for no limit
+        backoff_base real NOT NULL DEFAULT 1,  -- seconds to wait after the first failed delivery
+        backoff_multiplier real NOT NULL DEFAULT 2,  -- growth of the wait after every further failure
+        backoff_cap real NOT NULL DEFAULT 300,  -- longest wait between two attempts in seconds
+        backoff_jitter real NOT NULL DEFAULT 0.2,  -- fraction of a wait randomly shaved off
+        batch_size integer NOT NULL DEFAULT 1,  -- gists sent to the handler in one request, 1 sends each alone
+        batch_bytes integer NOT NULL DEFAULT 1048576,  -- most payload bytes sent in one request
+        accept_encoding integer NOT NULL DEFAULT 0,  -- compressed payloads are sent as they are stored
         handler text NOT NULL,
         description text,
         timestamped text NOT NULL,
@@ -51,24 +68,52 @@ BEGIN;
         retries integer NOT NULL,
         sleep_until text,
         timestamped text NOT NULL,
+        ordering_key text,  -- copied from its event so lanes are found without a join
 
         UNIQUE(event, subscription)
     );
+
+    -- finished gists are moved here out of the way of the dispatcher, keeping the id they had
+    CREATE TABLE IF NOT EXISTS gists_archive (
+        rowid integer primary key,
+        event integer NOT NULL,
+        subscription integer NOT NULL,
+        completed integer NOT NULL,
+        retries integer NOT NULL,
+        timestamped text NOT NULL
+    );
+
+    -- the dispatcher only ever reads pending gists in event order, delivered ones stay out of its index
+    CREATE INDEX IF NOT EXISTS gists_pending ON gists(event, sleep_until) WHERE completed = 0;
+    CREATE INDEX IF NOT EXISTS gists_subscription ON gists(subscription);
+    CREATE INDEX IF NOT EXISTS events_action ON events(action);
+    CREATE INDEX IF NOT EXISTS subscriptions_action ON subscriptions(action);
+    CREATE INDEX IF NOT EXISTS gists_finished ON gists(completed) WHERE completed <> 0;
+    CREATE INDEX IF NOT EXISTS gists_archive_timestamped ON gists_archive(timestamped);
+    CREATE INDEX IF NOT EXISTS dedupes_expires ON dedupes(expires) WHERE expires IS NOT NULL;
 COMMIT;
 '''
 
+# columns added after a table was first shipped, sqlite has no ADD COLUMN IF NOT EXISTS so each runs alone
+migrationscripts = [
+    'ALTER TABLE subscriptions ADD COLUMN max_concurrency integer',
+    'ALTER TABLE subscriptions ADD COLUMN backoff_base real NOT NULL DEFAULT 1',
+    'ALTER TABLE subscriptions ADD COLUMN backoff_multiplier real NOT NULL DEFAULT 2',
+    'ALTER TABLE subscriptions ADD COLUMN backoff_cap real NOT NULL DEFAULT 300',
+    'ALTER TABLE subscriptions ADD COLUMN backoff_jitter real NOT NULL DEFAULT 0.2',
+    'ALTER TABLE events ADD COLUMN ordering_key text',
+    'ALTER TABLE gists ADD COLUMN ordering_key text',
+    'ALTER TABLE subscriptions ADD COLUMN batch_size integer NOT NULL DEFAULT 1',
+    'ALTER TABLE subscriptions ADD COLUMN batch_bytes integer NOT NULL DEFAULT 1048576',
+    'ALTER TABLE actions ADD COLUMN compression text',
+    'ALTER TABLE events ADD COLUMN encoding text',
+    'ALTER TABLE events ADD COLUMN packed blob',
+    'ALTER TABLE subscriptions ADD COLUMN accept_encoding integer NOT NULL DEFAULT 0',
+    # indexes on added columns come after them, the earliest pending gist of a lane holds the rest back
+    '''CREATE INDEX IF NOT EXISTS gists_lane ON gists(subscription, ordering_key, event)
+        WHERE completed = 0 AND ordering_key IS NOT NULL''',
+]
+
 insertscript = '''
     INSERT INTO credentials VALUES(?, ?)
 '''
-
-tidydatabase = '''
-    CREATE TRIGGER IF NOT EXISTS
-        prune_gists
-    AFTER INSERT ON
-        gists
-    WHEN
-        count(*) > 1_000_000
-    BEGIN
-        DELETE FROM gists WHERE timestamped < '14 days ago'
-    END
-'''
@@ -5,12 +5,12 @@ from sqlite3 import Connection, Cursor
 from heaven import Context, Request, Response
 from orjson import dumps, loads
 
-from amebo.constants.literals import DB, MAX_PAGINATION
+from amebo.constants.literals import DB
 from amebo.decorators.formatters import jsonify
 from amebo.decorators.providers import contextualize, expects
-from amebo.decorators.providers import cacheschema
 from amebo.models.actions import Action
-from amebo.utils.helpers import get_pagination, get_timeline
+from amebo.utils.registry import reschema
+from amebo.utils.helpers import get_pagination, get_timeline, paginate
 from amebo.utils.structs import Steps
 
 
@@ -18,7 +18,7 @@ from amebo.utils.structs import Steps
 @contextualize
 async def tabulate(req: Request, res: Response, ctx: Context):
     db: Connection = req.app.peek(DB)
-    page, pagination = get_pagination(req)
+    after, pagination = get_pagination(req)
     params = ['id', 'action', 'application', 'schemata', 'timeline']
     _id, _action, _application, _schemata, _timeline = [req.queries.get(p) for p in params]
 
@@ -27,18 +27,19 @@ async def tabulate(req: Request, res: Response, ctx: Context):
 
     sqls = f'''
         SELECT
-            rowid, action, application, schemata, timestamped
+            rowid, action, application, schemata, compression, timestamped
         FROM
             {executor.schema}actions
             {steps.EQUALS('rowid', _id)}
             {steps.LIKE('action', _action)}
             {steps.LIKE('application', _application)}
             {steps.LIKE('schemata', _schemata)}
+            {steps.AFTER('rowid', after)}
             {get_timeline(_timeline, steps)}
-        LIMIT {pagination if pagination < MAX_PAGINATION else MAX_PAGINATION}
-        OFFSET {(page - 1) * pagination};
+        ORDER BY rowid
+        LIMIT {pagination + 1};
     '''
-    try: rows = await executor.fetch(2).execute(sqls, *steps.values)
+    try: rows = paginate(res, await executor.fetch(2).execute(sqls, *steps.values), pagination)
     except Exception as exc:
         res.status = HTTPStatus.BAD_REQUEST
         res.body = {'error': f'{exc}'}
@@ -50,8 +51,9 @@ async def tabulate(req: Request, res: Response, ctx: Context):
         'action': action,
         'application': application,
         'schemata': loads(schemata),
+        'compression': compression,
         'timestamped': timestamped
-    } for id, action, application, schemata, timestamped in rows]
+    } for id, action, application, schemata, compression, timestamped in rows]
 
 
 @jsonify
@@ -65,8 +67,10 @@ async def insert(req: Request, res: Response, ctx: Context):
     executor = ctx.executor
 
     table = 'actions'
-    fields = ('action', 'application', 'schemata', 'timestamped',)
-    values = (action.action, action.application, dumps(action.schemata).decode(), action.timestamped.isoformat())
+    fields = ('action', 'application', 'schemata', 'compression', 'timestamped',)
+    values = (
+        action.action, action.application, dumps(action.schemata).decode(), action.compression,
+        action.timestamped.isoformat())
 
     try:
         sqls = f'''select application, secret from {executor.schema}applications where application = {steps.next()}'''
@@ -79,12 +83,12 @@ async def insert(req: Request, res: Response, ctx: Context):
     except Exception as exc: return res.out(HTTPStatus.UNAUTHORIZED, {'error': f'{exc}'})
     
     try:
-        sqls = f'''INSERT INTO {executor.schema}{table}({', '.join(fields)}) VALUES ({steps.reset.next(4)})'''
+        sqls = f'''INSERT INTO {executor.schema}{table}({', '.join(fields)}) VALUES ({steps.reset.next(len(fields))})'''
         print(sqls)
         await executor.fetch(0).execute(sqls, *values)
     except Exception as exc: return res.out(HTTPStatus.UPGRADE_REQUIRED, {'error': f'{exc}'})
+    await reschema(req.app, executor, action.action)
 
-    ctx.keep('schemata', action.schemata)
     res.status = HTTPStatus.CREATED
     res.body = action.model_dump()
 
@@ -7,10 +7,11 @@ from bcrypt import checkpw
 from heaven import Context, Request, Response
 
 # src code
-from amebo.constants.literals import DB, AMEBO_SECRET, MAX_PAGINATION
+from amebo.constants.literals import DB, AMEBO_SECRET
 from amebo.decorators.formatters import jsonify
 from amebo.decorators.providers import contextualize, expects
-from amebo.utils.helpers import get_pagination, get_timeline, tokenize
+from amebo.dispatch.routes import reroute
+from amebo.utils.helpers import get_pagination, get_timeline, paginate, tokenize
 
 from amebo.models.applications import Credential, Location, Application, Token
 from amebo.utils.structs import Steps
@@ -63,22 +64,23 @@ async def authenticate(req: Request, res: Response, ctx: Context):
 @contextualize
 async def tabulate(req: Request, res: Response, ctx: Context):
     db: Connection = req.app.peek(DB)
-    page, pagination = get_pagination(req)
+    after, pagination = get_pagination(req)
     params = ['application', 'address', 'timeline']
     _application, _address, _timeline = [req.queries.get(p) for p in params]
     steps = Steps(req.app._.engine)
 
     executor = ctx.executor
 
-    sqls = f'''SELECT application, address, timestamped
+    sqls = f'''SELECT rowid, application, address, timestamped
         FROM {executor.schema}applications
             {steps.LIKE('application', _application)}
             {steps.LIKE('address', _address)}
+            {steps.AFTER('rowid', after)}
             {get_timeline(_timeline, steps)}
-        LIMIT {pagination if pagination < MAX_PAGINATION else MAX_PAGINATION}
-        OFFSET {(page - 1) * pagination};
+        ORDER BY rowid
+        LIMIT {pagination + 1};
     '''
-    try: rows = await executor.fetch(2).execute(sqls, *steps.values)
+    try: rows = paginate(res, await executor.fetch(2).execute(sqls, *steps.values), pagination)
     except Exception as exc:
         res.status = HTTPStatus.BAD_REQUEST
         res.body = {'error': f'{exc}'}
@@ -90,7 +92,7 @@ async def tabulate(req: Request, res: Response, ctx: Context):
         'address': address,
         'secret': '****************',
         'timestamped': timestamped
-    } for application, address, timestamped in rows]
+    } for _, application, address, timestamped in rows]
 
 
 @jsonify
@@ -126,24 +128,22 @@ async def insert(req: Request, res: Response, ctx: Context):
 @jsonify
 @expects(Location)
 @contextualize
-def update(req: Request, res: Response, ctx: Context):
-    db: Connection = req.app.peek(DB)
+async def update(req: Request, res: Response, ctx: Context):
     application = req.params.get('id')
     location: Location = ctx.location
 
-    executor = ctx.executor()
+    steps = Steps(req.app._.engine)
+    executor = ctx.executor
     try:
-        cursor = db.cursor()
-        cursor.execute(f'''
-            UPDATE applications SET address = {executor.next()}
-                WHERE application = {executor.next()} AND secret = {executor.next()}
-        ''', (location.location, application, location.secret))
+        await executor.execute(f'''
+            UPDATE {executor.schema}applications SET address = {steps.next()}
+                WHERE application = {steps.next()} AND secret = {steps.next()}
+        ''', str(location.location), application, location.secret)
     except Exception as exc:
         res.status = HTTPStatus.BAD_REQUEST
         res.body = {'error': 'could not update application'}
         return
-    finally:
-        cursor.close()
+    await reroute(req.app, executor)
 
     # no feedback if provided if secret key mismatches i.e. continue indicates just that
     res.status = HTTPStatus.ACCEPTED
@@ -1,16 +1,24 @@
 from datetime import datetime, timedelta
 from http import HTTPStatus
+from itertools import chain
 from sqlite3 import Connection
+from time import perf_counter
+from typing import Optional
 
-from fastjsonschema import JsonSchemaException, compile
+from fastjsonschema import JsonSchemaException
 from heaven import Context, Request, Response
 from orjson import dumps, loads
+from pydantic import ValidationError
 
-from amebo.constants.literals import DB, MAX_PAGINATION
+from amebo.constants.literals import (
+    CREATED, DB, DUPLICATE, GISTS_CHANNEL, INVALID, NDJSON, SCHEDULER, SCHEMATAS, WARNING_HEADER)
 from amebo.decorators.formatters import jsonify
-from amebo.decorators.providers import contextualize, expects
+from amebo.decorators.providers import Executor, contextualize, expects
 from amebo.models.events import Events
-from amebo.utils.helpers import get_pagination, get_timeline
+from amebo.utils.compression import compress, decompress, encoding
+from amebo.utils.registry import Registry
+from amebo.utils.helpers import digest, get_pagination, get_timeline, paginate
+from amebo.utils.metrics import BATCH_SECONDS, INGESTED, INGEST_SECONDS, VALIDATION_SECONDS
 from amebo.utils.structs import Steps
 
 
@@ -18,7 +26,7 @@ from amebo.utils.structs import Steps
 @contextualize
 async def tabulate(req: Request, res: Response, ctx: Context):
     db: Connection = req.app.peek(DB)
-    page, pagination = get_pagination(req)
+    after, pagination = get_pagination(req)
 
     params = ['id', 'action', 'deduper', 'payload', 'timeline']
     _id, _action,  _deduper, _payload, _timeline = [req.queries.get(p) for p in params]
@@ -27,95 +35,348 @@ async def tabulate(req: Request, res: Response, ctx: Context):
     executor = ctx.executor
 
     sqls = f'''SELECT
-            event, action, payload, deduper, timestamped, COUNT(*) AS results
+            event, action, payload, deduper, ordering_key, encoding, packed, timestamped
         FROM {executor.schema}events
             {steps.EQUALS('event', _id)}
             {steps.LIKE('action', _action)}
             {steps.LIKE('payload', _payload)}
             {steps.EQUALS('deduper', _deduper)}
+            {steps.AFTER('event', after)}
             {get_timeline(_timeline, steps)}
-        GROUP BY
-            event, action, deduper, payload, timestamped
-        LIMIT {pagination if pagination < MAX_PAGINATION else MAX_PAGINATION}
-        OFFSET {(page - 1) * pagination};
+        ORDER BY event
+        LIMIT {pagination + 1};
     '''
-    try: rows = await executor.fetch(2).execute(sqls, *steps.values)
+    try:
+        rows = paginate(res, await executor.fetch(2).execute(sqls, *steps.values), pagination)
+        if _payload: await _unsearchable(res, executor, _action)
     except Exception as exc:
         return res.out(HTTPStatus.BAD_REQUEST, [])
 
+    body, unreadable = [], []
+    for event, action, payload, deduper, ordering_key, encoded, packed, timestamped in rows:
+        try: payload = loads(decompress(encoded, packed) if encoded else payload)
+        except Exception:
+            # e.g. zstd on a node without zstandard, the event is listed with the digest its payload column holds
+            unreadable.append(str(event))
+        body.append({
+            'event': event,
+            'action': action,
+            'payload': payload,
+            'deduper': deduper,
+            'ordering_key': ordering_key,
+            'timestamped': timestamped
+        })
+    if unreadable: res.headers = WARNING_HEADER, (
+        'payloads of events ' + ', '.join(unreadable) + ' could not be decompressed, their digests are given')
+
     res.status = HTTPStatus.OK
-    res.body = [{
-        'event': event,
-        'action': action,
-        'payload': loads(payload),
-        'deduper': deduper,
-        'timestamped': timestamped
-    } for event, action, payload, deduper, timestamped, results in rows]
+    res.body = body
+
+
+async def _unsearchable(res: Response, executor: Executor, action: Optional[str]):
+    """compressed payloads only keep their digest in plain text, the client is told the filter missed them"""
+    steps = Steps(executor.engine)
+    rows = await executor.fetch(2).execute(f'''
+        SELECT action FROM {executor.schema}actions {steps.LIKE('action', action)}
+        {'AND' if steps.dirty else 'WHERE'} compression IS NOT NULL ORDER BY action LIMIT 10;
+    ''', *steps.values)
+    if rows: res.headers = WARNING_HEADER, (
+        'payload filter does not match compressed events of ' + ', '.join(action for action, in rows))
+
+
+def _pack(payload: str, digested: bytes, wanted: Optional[str], over: int) -> tuple:
+    """
+    payload, encoding and packed as stored, a large payload of an action asking for it is compressed. its
+    payload column then only holds the digest, which keeps events apart in databases still unique on payloads
+    """
+    encoded = encoding(wanted)
+    if not encoded or len(payload) < over: return payload, None, None
+    return digested.hex(), encoded, compress(encoded, payload.encode())
+
+
+def _dedupescript(x: str, digests: str, window: str) -> str:
+    """claims digests not held yet or whose window is over and returns them, the rest are duplicates"""
+    return f'''
+            INSERT INTO {x}dedupes AS d(digest, expires)
+            SELECT digest, CASE WHEN {window}::integer > 0 THEN now() + make_interval(secs => {window}::integer) END
+            FROM {digests}
+            ON CONFLICT (digest) DO UPDATE SET expires = EXCLUDED.expires, created = EXCLUDED.created
+                WHERE d.expires < now()
+            RETURNING digest
+    '''
+
+
+async def _pginsert(executor: Executor, values: tuple, window: int):
+    """
+    one statement so the event and its gists commit together. gives the event, none when it is a duplicate,
+    and whether the action exists
+    """
+    x = executor.schema
+    row = await executor.fetch(1).execute(f'''
+        WITH known AS (
+            SELECT action, $7::bytea AS digest FROM {x}actions WHERE action = $1
+        ), deduped AS ({_dedupescript(x, 'known', '$10')}
+        ), inserted AS (
+            INSERT INTO {x}events(action, payload, deduper, timestamped, ordering_key, encoding, packed)
+            SELECT action, $2, $3, $4, $6, $8, $9 FROM known WHERE EXISTS (SELECT 1 FROM deduped)
+            RETURNING event
+        ), fanout AS (
+            INSERT INTO {x}gists(event, subscription, completed, retries, sleep_until, timestamped, ordering_key)
+            SELECT i.event, s.subscription, 0, 0, $5::text::timestamptz, $4, $6
+            FROM inserted i JOIN {x}subscriptions s ON s.action = $1
+            RETURNING 1
+        ), notified AS (
+            -- wakes the dispatchers of every node listening, delivered by postgres when this commits
+            SELECT pg_notify('{GISTS_CHANNEL}', '') WHERE $5::text IS NULL AND EXISTS (SELECT 1 FROM fanout)
+        )
+        SELECT (SELECT event FROM inserted), EXISTS (SELECT 1 FROM known) FROM (SELECT count(*) FROM notified) n;
+    ''', *values, window)
+    return row[0], row[1]
+
+
+def _sqlitededupes(digests: list, window: int) -> tuple:
+    """the statement claiming digests as in _dedupescript and its values"""
+    now = datetime.now()
+    expires = (now + timedelta(seconds=window)).isoformat() if window > 0 else None
+    return f'''
+        INSERT INTO dedupes(digest, expires, timestamped) VALUES {', '.join(['(?, ?, ?)'] * len(digests))}
+        ON CONFLICT (digest) DO UPDATE SET expires = excluded.expires, timestamped = excluded.timestamped
+            WHERE dedupes.expires < excluded.timestamped
+        RETURNING digest;
+    ''', [value for digested in digests for value in (digested, expires, now.isoformat())]
+
+
+async def _sqliteinsert(executor: Executor, values: tuple, window: int):
+    """the digest, event and gists commit together as with postgres, a failure leaves the digest unclaimed"""
+    steps = Steps(executor.engine)
+    action, payload, deduper, timestamped, sleep_until, ordering_key, digested, encoded, packed = values
+    sqls, dedupes = _sqlitededupes([digested], window)
+
+    def insert(conn: Connection):
+        if not conn.execute(sqls, dedupes).fetchall(): return None
+        # databases made before digests keep their unique payloads, an event they turn down is a duplicate too
+        row = conn.execute(f'''
+            INSERT INTO events(action, payload, deduper, timestamped, ordering_key, encoding, packed)
+            VALUES ({steps.next(7)}) ON CONFLICT DO NOTHING RETURNING event;
+        ''', (action, payload, deduper, timestamped, ordering_key, encoded, packed)).fetchall()
+        if not row: return None
+        conn.execute(f'''
+            INSERT INTO gists(event, subscription, completed, retries, sleep_until, timestamped, ordering_key)
+            SELECT {steps.reset.next()}, subscription, 0, 0, {steps.next()}, {steps.next()}, {steps.next()}
+            FROM subscriptions WHERE action = {steps.next()};
+        ''', (row[0][0], sleep_until, timestamped, ordering_key, action))
+        return row[0][0]
+    return await executor.db.atomic(insert), True
 
 
 @jsonify
 @expects(Events)
 @contextualize
 async def insert(req: Request, res: Response, ctx: Context):
-    db: Connection = req.app.peek(DB)
     event: Events = ctx.events
+    started = perf_counter()
 
-    steps = Steps(req.app._.engine)
     try:
         executor = ctx.executor
-        sqls = f'''
-            SELECT
-                schemata, actions.application, app.secret
-            FROM
-                {executor.schema}actions
-            JOIN {executor.schema}applications app ON app.application = actions.application
-            WHERE
-                action = {steps.next()}
-        '''
-        row = await executor.fetch(1).execute(sqls, event.action)
-        if not row: return res.out(HTTPStatus.UNPROCESSABLE_ENTITY, {'error': 'Action can not be used to process any events'})
-
-        schemata = loads(row[0])  # load the schemata from the db
-        if isinstance(schemata, str): schemata = loads(schemata)
-        schemas = req.app.peek('schematas')  # get the compiled schematas
-        if not schemas.get(event.action): schemas[event.action] = compile(schemata)
-        validation = schemas.get(event.action)
-        validation(event.payload)
-
-        table = f'{executor.schema}events'
-        fields = ['action', 'payload', 'deduper', 'timestamped',]
-        values = [
-            event.action,
-            dumps(event.payload).decode(),
-            event.deduper,
-            event.timestamped.isoformat()
-        ]
+        registry: Registry = req.app.peek(SCHEMATAS)
+        validation = await registry.validator(executor, event.action)
+        if validation is None:
+            INGESTED.inc('', INVALID)  # unknown actions are not labelled by name, anyone can make them up
+            return res.out(HTTPStatus.UNPROCESSABLE_ENTITY, {'error': 'Action can not be used to process any events'})
+        validating = perf_counter()
+        try: validation(event.payload)
+        finally: VALIDATION_SECONDS.observe(perf_counter() - validating, event.action)
 
-        sqls = f'''INSERT INTO {table} ({', '.join(fields)}) VALUES ({steps.reset.next(4)}) RETURNING rowid;'''
-        eventid = await executor.fetch(1).execute(sqls, *values)
         sleep_until = None
         if event.sleep_until:
             sleep_until = datetime.now() + timedelta(seconds = event.sleep_until)
-
-        sqls = f'''
-            INSERT INTO
-                {executor.schema}gists(event, subscription, completed, retries, sleep_until, timestamped)
-            SELECT
-                {eventid[0]}, subscription, 0, 0, '{sleep_until.isoformat() if sleep_until else None}', '{event.timestamped.isoformat()}'
-            FROM {executor.schema}subscriptions WHERE action = {steps.reset.next()}
-        '''
-        await executor.fetch(0).execute(sqls, event.action)
+        payload = dumps(event.payload).decode()
+        digested = digest(event.deduper, payload)
+        stored, encoded, packed = _pack(
+            payload, digested, registry.compression(event.action), req.app.CONFIG('compress_over'))
+        values = (
+            event.action,
+            stored,
+            event.deduper,
+            event.timestamped.isoformat(),
+            sleep_until.isoformat() if sleep_until else None,
+            event.ordering_key,
+            digested,
+            encoded,
+            packed
+        )
+        window = req.app.CONFIG('dedup_window')
+        if req.app._.engine.startswith('postgres'): eventid, known = await _pginsert(executor, values, window)
+        else: eventid, known = await _sqliteinsert(executor, values, window)
+        if not known: return res.out(HTTPStatus.UNPROCESSABLE_ENTITY, {'error': 'Action can not be used to process any events'})
+        if eventid is None:
+            INGESTED.inc(event.action, DUPLICATE)
+            return res.out(HTTPStatus.CONFLICT, {'error': 'Event is a duplicate of an earlier one'})
+        if not event.sleep_until: req.app.peek(SCHEDULER).wake()
     except JsonSchemaException:
+        INGESTED.inc(event.action, INVALID)
         return res.out(HTTPStatus.NOT_ACCEPTABLE, {'error': f'Event payload does not conform to {event.action} schema'})
     except ModuleNotFoundError as exc:
         return res.out(HTTPStatus.UPGRADE_REQUIRED, {'error': f'{exc}'})
 
+    INGESTED.inc(event.action, CREATED)
+    INGEST_SECONDS.observe(perf_counter() - started, event.action)
     res.status = HTTPStatus.CREATED
     res.body = {
-        'event': eventid[0],
+        'event': eventid,
         'payload': event.payload,
         'action': event.action,
         'sleep_until': sleep_until,
         'deduper': event.deduper,
         'timestamped': event.timestamped
     }
+
+
+def _unbatch(req: Request) -> list:
+    """a json array of events, or one json event per line when sent as ndjson"""
+    if (req.headers.get('content-type') or '').split(';')[0].strip() == NDJSON:
+        return [loads(line) for line in req.body.splitlines() if line.strip()]
+    events = loads(req.body)
+    if not isinstance(events, list): raise ValueError('expected an array of events')
+    return events
+
+
+async def _pgbatch(executor: Executor, rows: list, window: int) -> list:
+    """one round trip: events, their gists and the dispatcher wake up, duplicates are left out"""
+    x = executor.schema
+    return await executor.fetch(2).execute(f'''
+        WITH incoming AS (
+            SELECT * FROM unnest(
+                $1::text[], $2::text[], $3::text[], $4::text[], $5::text[], $6::text[], $7::bytea[], $8::text[],
+                $9::bytea[]
+            ) WITH ORDINALITY AS i(
+                action, deduper, payload, timestamped, sleep_until, ordering_key, digest, encoding, packed, item)
+        ), deduped AS ({_dedupescript(x, 'incoming', '$10')}
+        ), inserted AS (
+            INSERT INTO {x}events(action, deduper, payload, timestamped, ordering_key, encoding, packed)
+            SELECT action, deduper, payload, timestamped, ordering_key, encoding, packed FROM incoming
+            WHERE digest IN (SELECT digest FROM deduped) ORDER BY item
+            ON CONFLICT DO NOTHING
+            RETURNING event, deduper, payload, packed
+        ), matched AS (
+            SELECT i.*, n.event FROM inserted n JOIN incoming i ON
+                i.deduper = n.deduper AND i.payload = n.payload AND i.packed IS NOT DISTINCT FROM n.packed
+        ), fanout AS (
+            INSERT INTO {x}gists(event, subscription, completed, retries, sleep_until, timestamped, ordering_key)
+            SELECT m.event, s.subscription, 0, 0, m.sleep_until::timestamptz, m.timestamped, m.ordering_key
+            FROM matched m JOIN {x}subscriptions s ON s.action = m.action
+            RETURNING sleep_until
+        ), notified AS (
+            SELECT pg_notify('{GISTS_CHANNEL}', '') WHERE EXISTS (SELECT 1 FROM fanout WHERE sleep_until IS NULL)
+        )
+        SELECT m.item - 1, m.event FROM matched m LEFT JOIN notified ON true;
+    ''', *map(list, zip(*rows)), window)
+
+
+async def _sqlitebatch(executor: Executor, rows: list, window: int) -> list:
+    """digests, events and gists commit together in one writer call, as one statement does with postgres"""
+    steps = Steps(executor.engine)
+    sqls, dedupes = _sqlitededupes([row[6] for row in rows], window)
+
+    def insert(conn: Connection) -> list:
+        claimed = {digested for digested, in conn.execute(sqls, dedupes).fetchall()}
+        items = {(row[1], row[2], row[8]): item for item, row in enumerate(rows) if row[6] in claimed}
+        if not items: return []
+        inserted = conn.execute(f'''
+            INSERT INTO events(action, deduper, payload, timestamped, ordering_key, encoding, packed)
+            VALUES {', '.join(f'({steps.next(7)})' for _ in items)}
+            ON CONFLICT DO NOTHING
+            RETURNING event, deduper, payload, packed;
+        ''', [*chain.from_iterable((*rows[item][:4], rows[item][5], *rows[item][7:]) for item in items.values())])
+        inserted = inserted.fetchall()
+        if not inserted: return []
+
+        created = [(items[(deduper, payload, packed)], event) for event, deduper, payload, packed in inserted]
+        fanout = []
+        for item, event in created:
+            action, _, _, timestamped, sleep_until, ordering_key, *_ = rows[item]
+            fanout.append((event, action, sleep_until, timestamped, ordering_key))
+        conn.execute(f'''
+            INSERT INTO gists(event, subscription, completed, retries, sleep_until, timestamped, ordering_key)
+            SELECT i.column1, s.subscription, 0, 0, i.column3, i.column4, i.column5
+            FROM (VALUES {', '.join(f'({steps.next(5)})' for _ in fanout)}) AS i
+            JOIN subscriptions s ON s.action = i.column2;
+        ''', [*chain.from_iterable(fanout)])
+        return created
+    return await executor.db.atomic(insert)
+
+
+@jsonify
+@contextualize
+async def batch(req: Request, res: Response, ctx: Context):
+    started = perf_counter()
+    try: items = _unbatch(req)
+    except Exception as exc: return res.out(HTTPStatus.BAD_REQUEST, {'error': f'{exc}'})
+    if len(items) > req.app.CONFIG('batch_size'):
+        return res.out(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {'error': f'at most {req.app.CONFIG("batch_size")} events per batch'})
+
+    results, events = [None] * len(items), {}
+    for item, body in enumerate(items):
+        try: events[item] = Events(**body)
+        except ValidationError as exc:
+            error = exc.errors()[0]
+            results[item] = {'status': INVALID, 'error': f"{error.get('loc')[0]} - {error.get('msg')}"}
+        except Exception: results[item] = {'status': INVALID, 'error': 'event must be a json object'}
+
+    # actions missing from the schema registry are loaded together, duplicates within the batch are
+    # settled here as the database only sees the first of them
+    executor = ctx.executor
+    registry: Registry = req.app.peek(SCHEMATAS)
+    validators = {action: registry.get(action) for action in {event.action for event in events.values()}}
+    try: await registry.load(executor, [action for action, validator in validators.items() if validator is None])
+    except Exception as exc: return res.out(HTTPStatus.BAD_REQUEST, {'error': f'{exc}'})
+    validators = {action: validator or registry.peek(action) for action, validator in validators.items()}
+
+    rows, firsts, now, over = [], {}, datetime.now(), req.app.CONFIG('compress_over')
+    for item, event in events.items():
+        validation = validators[event.action]
+        if validation is None:
+            results[item] = {'status': INVALID, 'error': 'Action can not be used to process any events'}
+            continue
+        validating = perf_counter()
+        try: validation(event.payload)
+        except JsonSchemaException:
+            results[item] = {'status': INVALID, 'error': f'Event payload does not conform to {event.action} schema'}
+            continue
+        finally: VALIDATION_SECONDS.observe(perf_counter() - validating, event.action)
+
+        payload = dumps(event.payload).decode()
+        digested = digest(event.deduper, payload)
+        if digested in firsts:
+            results[item] = {'status': DUPLICATE, 'of': firsts[digested]}
+            continue
+        firsts[digested] = item
+        sleep_until = (now + timedelta(seconds=event.sleep_until)).isoformat() if event.sleep_until else None
+        stored, encoded, packed = _pack(payload, digested, registry.compression(event.action), over)
+        rows.append((
+            event.action, event.deduper, stored, event.timestamped.isoformat(), sleep_until, event.ordering_key,
+            digested, encoded, packed))
+
+    created, order = [], list(firsts.values())
+    if rows:
+        try:
+            window = req.app.CONFIG('dedup_window')
+            if req.app._.engine.startswith('postgres'): created = await _pgbatch(executor, rows, window)
+            else: created = await _sqlitebatch(executor, rows, window)
+        except Exception as exc: return res.out(HTTPStatus.BAD_REQUEST, {'error': f'{exc}'})
+
+    for position, event in created: results[order[position]] = {'status': CREATED, 'event': event}
+    for item in order:
+        if results[item] is None: results[item] = {'status': DUPLICATE}
+    for result in results:
+        if result['status'] == DUPLICATE and 'of' in result:
+            first = results[result.pop('of')]
+            if first.get('event'): result['event'] = first['event']
+
+    if any(not events[order[position]].sleep_until for position, _ in created): req.app.peek(SCHEDULER).wake()
+    for item, result in enumerate(results):
+        event = events.get(item)
+        INGESTED.inc(event.action if event and validators.get(event.action) else '', result['status'])
+    BATCH_SECONDS.observe(perf_counter() - started)
+    res.status = HTTPStatus.CREATED if all(r['status'] == CREATED for r in results) else HTTPStatus.MULTI_STATUS
+    res.body = [{'item': item, **result} for item, result in enumerate(results)]
@@ -3,26 +3,33 @@ from sqlite3 import Connection, Cursor, IntegrityError
 
 from heaven import Context, Request, Response
 from httpx import AsyncClient
-from orjson import loads
 
 from amebo.decorators.formatters import jsonify
 from amebo.decorators.security import protected
 from amebo.decorators.providers import contextualize
-from amebo.constants.literals import DB, MAX_PAGINATION
-from amebo.utils.helpers import get_pagination, get_timeline
+from amebo.constants.literals import CLIENT, DB, JSON_HEADERS, PASS_HEADER
+from amebo.database.archive import gistscript
+from amebo.dispatch.acks import DELIVERED, EXHAUSTED, PENDING
+from amebo.dispatch.queries import packable
+from amebo.utils.compression import decompress
+from amebo.utils.helpers import get_pagination, get_timeline, paginate
 from amebo.utils.structs import Steps
 
 
+STATES = {PENDING: 'pending', DELIVERED: 'delivered', EXHAUSTED: 'exhausted'}
+
+
 @jsonify
 @contextualize
 async def tabulate(req: Request, res: Response, ctx: Context):
     db: Connection = req.app.peek(DB)
-    page, pagination = get_pagination(req)
-    params = ['origin', 'destination', 'gist', 'event', 'completed', 'timeline']
-    _origin, _destination, _gist, _event, _completed, _timeline = [req.queries.get(p) for p in params]
-    _completed = _completed or 'all'
+    after, pagination = get_pagination(req)
+    params = ['origin', 'destination', 'gist', 'event', 'completed', 'state', 'timeline']
+    _origin, _destination, _gist, _event, _completed, _state, _timeline = [req.queries.get(p) for p in params]
+    _completed = (_completed or 'all').lower()
 
-    completed = {'all': '', 'true': 1, 'false': 0}.get(_completed.lower())
+    # completed is anything no longer pending i.e. delivered or exhausted, state tells those two apart
+    state = {name: value for value, name in STATES.items()}.get((_state or '').lower())
 
     steps = Steps(req.app._.engine)
     executor = ctx.executor
@@ -38,10 +45,11 @@ async def tabulate(req: Request, res: Response, ctx: Context):
                 'False'
             end as
                 completed,
+            g.completed as state,
             x.application as publisher,
             s.application as subscriber,
             g.timestamped
-        FROM {executor.schema}gists AS g JOIN {executor.schema}events e ON
+        FROM {gistscript(executor.schema)} AS g JOIN {executor.schema}events e ON
             g.event = e.event
         JOIN {executor.schema}subscriptions s ON
             g.subscription = s.subscription
@@ -49,16 +57,18 @@ async def tabulate(req: Request, res: Response, ctx: Context):
             s.action = x.action
         {steps.EQUALS('g.rowid', _gist)}
         {steps.LIKE('e.producer', _origin)}
-        {steps.EQUALS('g.completed', completed)}
+        {steps.NOT_EQUALS('g.completed', 0 if _completed == 'true' else None)}
+        {steps.EQUALS('g.completed', 0 if _completed == 'false' else None)}
+        {steps.EQUALS('g.completed', state)}
         {steps.LIKE('a.event', _event)}
         {steps.LIKE('p.name', _destination)}
+        {steps.AFTER('g.rowid', after)}
         {get_timeline(_timeline, steps, column='g.timestamped')}
         ORDER BY g.rowid
-        LIMIT {pagination if pagination < MAX_PAGINATION else MAX_PAGINATION}
-        OFFSET {(page - 1) * pagination};
+        LIMIT {pagination + 1};
     '''
     try:
-        rows = await executor.fetch(2).execute(sqls, *steps.values)
+        rows = paginate(res, await executor.fetch(2).execute(sqls, *steps.values), pagination)
     except Exception as exc:
         print('exc is: ', exc)
         res.status = HTTPStatus.BAD_REQUEST
@@ -70,10 +80,11 @@ async def tabulate(req: Request, res: Response, ctx: Context):
         'gist': gist,
         'action': action,
         'completed': completed,
+        'state': STATES.get(state),
         'publisher': publisher,
         'subscriber': subscriber,
         'timestamped': timestamped
-    } for gist, action, completed, publisher, subscriber, timestamped in rows]
+    } for gist, action, completed, state, publisher, subscriber, timestamped in rows]
 
 
 @jsonify
@@ -88,15 +99,16 @@ async def replay(req: Request, res: Response, ctx: Context):
     try:
         gist = await executor.fetch(1).execute(f'''
             SELECT
-                s.handler AS endpoint, e.payload, a.secret, g.rowid as gid
-            FROM gists AS g JOIN subscriptions s ON
+                s.handler AS endpoint, {packable(executor.engine)} AS payload, e.encoding, a.secret,
+                g.rowid as gid
+            FROM {gistscript(executor.schema)} AS g JOIN {executor.schema}subscriptions s ON
                 g.subscription = s.subscription
-            JOIN events e ON
+            JOIN {executor.schema}events e ON
                 g.event = e.event
-            JOIN applications a ON
+            JOIN {executor.schema}applications a ON
                 s.application = a.application
             WHERE g.rowid = {steps.next()};
-        ''', (id,))
+        ''', int(id))
     except Exception as exc:
         res.status = HTTPStatus.BAD_REQUEST
         res.body = {'error': f'{exc}'}
@@ -105,12 +117,13 @@ async def replay(req: Request, res: Response, ctx: Context):
     if not gist: return res.out(HTTPStatus.NOT_FOUND, {'error': 'Gist not found'})
 
     try:
-        sender = AsyncClient()
+        sender: AsyncClient = req.app.peek(CLIENT)
 
-        endpoint, payload, secret, gid = gist
-        headers = {'content-type': 'application/json', 'x-pass-phrase': secret}
+        endpoint, payload, encoding, secret, gid = gist
+        if encoding: payload = decompress(encoding, payload)
+        headers = {**JSON_HEADERS, PASS_HEADER: secret}
 
-        response = await sender.post(endpoint, json=loads(payload), headers=headers)
+        response = await sender.post(endpoint, content=payload, headers=headers)
         if response.status_code not in [HTTPStatus.ACCEPTED, HTTPStatus.OK]:
             raise ConnectionRefusedError('Endpoint maybe offline, failed to handle gist')
     except ConnectionRefusedError as exc:
@@ -123,10 +136,8 @@ async def replay(req: Request, res: Response, ctx: Context):
         res.status = HTTPStatus.BAD_GATEWAY
         res.body = {'error': f'{exc}'}
         return
-    finally:
-        await sender.aclose()
 
-    res.satus = HTTPStatus.ACCEPTED
+    res.status = HTTPStatus.ACCEPTED
     try: proxied = response.json()
     except: proxied = None
     res.body = {'gist': gid, 'proxied': proxied}
@@ -0,0 +1,47 @@
+from http import HTTPStatus
+
+from heaven import Context, Request, Response
+
+from amebo.constants.literals import BREAKERS, DB, SCHEDULER, SCHEMATAS
+from amebo.decorators.providers import contextualize
+from amebo.dispatch.breakers import HALF_OPEN, OPEN, Breakers
+from amebo.dispatch.scheduler import Scheduler
+from amebo.utils.metrics import BREAKER_STATE, INFLIGHT, PENDING, POOL, PROMETHEUS, SCHEMAS, metrics
+from amebo.utils.registry import Registry
+
+
+@contextualize
+async def scrape(req: Request, res: Response, ctx: Context):
+    """gauges of shared state are read as prometheus asks, everything else was recorded as it happened"""
+    executor = ctx.executor
+    db = req.app.peek(DB)
+    POOL.clear()
+    if executor.engine.startswith('postgres') and db is not None:
+        POOL.set(db.get_size() - db.get_idle_size(), 'busy')
+        POOL.set(db.get_idle_size(), 'idle')
+        POOL.set(db.get_max_size(), 'max')
+    elif db is not None:
+        POOL.set(db.queued, 'queued')  # sqlite writes waiting on its one writer
+
+    scheduler: Scheduler = req.app.peek(SCHEDULER)
+    if scheduler is not None: INFLIGHT.set(scheduler.pending)
+
+    breakers: Breakers = req.app.peek(BREAKERS)
+    BREAKER_STATE.clear()  # closed breakers are dropped so hosts that recovered stop showing
+    if breakers is not None:
+        for host, state in breakers.states().items():
+            if state in (OPEN, HALF_OPEN): BREAKER_STATE.set(1 if state == OPEN else 0.5, host)
+
+    registry: Registry = req.app.peek(SCHEMATAS)
+    if registry is not None:
+        SCHEMAS.set(registry.hits, 'hit')
+        SCHEMAS.set(registry.misses, 'miss')
+
+    try:
+        row = await executor.fetch(1).execute(f'SELECT count(*) FROM {executor.schema}gists WHERE completed = 0;')
+        if row: PENDING.set(row[0])
+    except Exception as exc: print('Could not count pending gists: ', exc)
+
+    res.status = HTTPStatus.OK
+    res.headers = 'Content-Type', PROMETHEUS
+    res.body = metrics.render()
@@ -4,11 +4,13 @@ from sqlite3 import Connection, Cursor
 
 from heaven import Context, Request, Response
 
-from amebo.constants.literals import DB, MAX_PAGINATION
+from amebo.constants.literals import BREAKERS, DB
 from amebo.decorators.formatters import jsonify
 from amebo.decorators.providers import contextualize, expects
+from amebo.dispatch.breakers import CLOSED, Breakers, hostof
+from amebo.dispatch.routes import reroute
 from amebo.models.subscriptions import Subscriptions
-from amebo.utils.helpers import get_pagination, get_timeline
+from amebo.utils.helpers import get_pagination, get_timeline, paginate
 from amebo.utils.structs import Steps
 
 
@@ -16,7 +18,7 @@ from amebo.utils.structs import Steps
 @contextualize
 async def tabulate(req: Request, res, ctx: Context):
     db: Connection = req.app.peek(DB)
-    page, pagination = get_pagination(req)
+    after, pagination = get_pagination(req)
     qstrings = ['id', 'application', 'matchrule', 'action', 'endpoint', 'description', 'timeline']
     [
         _id, _application, _matchrule,
@@ -33,16 +35,18 @@ async def tabulate(req: Request, res, ctx: Context):
             {steps.LIKE('action', _action)}
             {steps.LIKE('handler', _handler)}
             {steps.LIKE('description', _description)}
+            {steps.AFTER('subscription', after)}
             {get_timeline(_timeline, steps)}
-        LIMIT {pagination if pagination < MAX_PAGINATION else MAX_PAGINATION}
-        OFFSET {(page - 1) * pagination};
+        ORDER BY subscription
+        LIMIT {pagination + 1};
     '''
-    try: rows = await executor.fetch(2).execute(sqls, *steps.values)
+    try: rows = paginate(res, await executor.fetch(2).execute(sqls, *steps.values), pagination)
     except Exception as exc:
         res.status = HTTPStatus.BAD_REQUEST
         res.body = None
         return
 
+    breakers: Breakers = req.app.peek(BREAKERS)
     res.status = HTTPStatus.OK
     res.body = [{
         'subscription': subscription,
@@ -50,6 +54,7 @@ async def tabulate(req: Request, res, ctx: Context):
         'application': application,
         'endpoint': handler,
         'description': description,
+        'breaker': breakers.state(hostof(handler)) if breakers else CLOSED,  # as this node sees the host
         'timestamped': timestamped
     } for subscription, action, application, handler, description, timestamped in rows]
 
@@ -77,21 +82,33 @@ async def insert(req: Request, res: Response, ctx: Context):
     except: return res.out(HTTPStatus.UNPROCESSABLE_ENTITY, 'Can not process the event with information provided')
     address = f'{host}{subscriptions.handler}'
 
-    fields = ('application', 'action', 'max_retries', 'handler', 'timestamped',)
+    fields = (
+        'application', 'action', 'max_retries', 'max_concurrency',
+        'backoff_base', 'backoff_multiplier', 'backoff_cap', 'backoff_jitter', 'batch_size', 'batch_bytes',
+        'accept_encoding', 'handler', 'timestamped',)
     values = (
         subscriptions.application,  # subscribing application
         subscriptions.action,
         subscriptions.max_retries,
+        subscriptions.max_concurrency,
+        subscriptions.backoff_base,
+        subscriptions.backoff_multiplier,
+        subscriptions.backoff_cap,
+        subscriptions.backoff_jitter,
+        subscriptions.batch_size,
+        subscriptions.batch_bytes,
+        subscriptions.accept_encoding,
         address,
         datetime.now(tz=timezone.utc).isoformat()
     )
 
     try:
-        sqls = f'''INSERT INTO {executor.schema}subscriptions ({', '.join(fields)}) VALUES ({steps.reset.next(5)}) RETURNING rowid;'''
+        sqls = f'''INSERT INTO {executor.schema}subscriptions ({', '.join(fields)}) VALUES ({steps.reset.next(len(fields))}) RETURNING rowid;'''
         subscriptionid = await executor.execute(sqls, *values)
     except Exception as exc:
         print(exc)
         return res.out(HTTPStatus.UPGRADE_REQUIRED, {'error': f'{exc}'})
+    await reroute(req.app, executor)
 
     res.status = HTTPStatus.CREATED
     subscriptions.subscription = subscriptionid[0]
@@ -0,0 +1,89 @@
+from asyncio import Task, create_task, sleep
+
+from amebo.decorators.providers import Executor
+
+
+COLUMNS = 'rowid, event, subscription, completed, retries, timestamped'
+
+
+def gistscript(x: str) -> str:
+    """hot and archived gists read as one table, filters on it reach the indexes of both"""
+    return f'''(
+        SELECT {COLUMNS} FROM {x}gists
+        UNION ALL
+        SELECT {COLUMNS} FROM {x}gists_archive
+    )'''
+
+
+class Archiver(object):
+    """
+    Moves delivered and exhausted gists out of the gists table into gists_archive a batch at a time, so
+    the dispatcher's table and indexes only hold what is still in flight. At most `batch` gists are moved
+    every `interval` seconds, it waits longer when there is nothing to move.
+    """
+    def __init__(self, executor: Executor, batch: int, interval: float, idle: float = 30):
+        self.executor = executor
+        self.batch = batch
+        self.interval = interval
+        self.idle = idle
+        self._task: Task = None
+
+    def start(self):
+        if self.batch > 0: self._task = create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try: moved = await self.archive()
+            except Exception as exc:
+                print('Exception archiving gists: ', exc)
+                moved = 0
+            await sleep(self.interval if moved >= self.batch else max(self.interval, self.idle))
+
+    async def archive(self) -> int:
+        if self.executor.engine.startswith('postgres'): return await self._pgarchive()
+        return await self._sqlitearchive()
+
+    async def _pgarchive(self) -> int:
+        x = self.executor.schema
+        status = await self.executor.fetch(0).execute(f'''
+            WITH finished AS (
+                SELECT g.rowid, g.event, g.subscription, g.completed, g.retries, g.timestamped, g.created
+                FROM {x}gists g WHERE g.completed <> 0
+                AND NOT EXISTS (SELECT 1 FROM {x}gists_archive a WHERE a.rowid = g.rowid)
+                ORDER BY g.rowid LIMIT $1
+                FOR UPDATE SKIP LOCKED
+            ), copied AS (
+                INSERT INTO {x}gists_archive({COLUMNS}, created) SELECT * FROM finished
+                ON CONFLICT DO NOTHING
+                RETURNING rowid, created
+            )
+            -- only what was copied leaves, a gist whose id is already archived stays where it is
+            DELETE FROM {x}gists AS g USING copied c WHERE g.rowid = c.rowid AND g.created = c.created;
+        ''', self.batch)
+        return int(status.split()[-1]) if status else 0
+
+    async def _sqlitearchive(self) -> int:
+        # the newest gist always stays as sqlite would otherwise hand its id out again, and a gist whose id
+        # is already archived is never picked as it could not be copied
+        rows = await self.executor.fetch(2).execute('''
+            SELECT rowid FROM gists g WHERE completed <> 0
+            AND rowid < (SELECT max(rowid) FROM gists)
+            AND NOT EXISTS (SELECT 1 FROM gists_archive a WHERE a.rowid = g.rowid) LIMIT ?;
+        ''', self.batch) or []
+        if not rows: return 0
+        gists = ', '.join(str(int(gid)) for gid, in rows)
+        # a script commits both statements together, so a gist is never in both tables or in neither
+        await self.executor.db.script(f'''
+            BEGIN IMMEDIATE;
+                INSERT OR IGNORE INTO gists_archive({COLUMNS})
+                    SELECT {COLUMNS} FROM gists WHERE rowid IN ({gists}) AND completed <> 0;
+                DELETE FROM gists WHERE rowid IN ({gists}) AND completed <> 0 AND EXISTS (
+                    SELECT 1 FROM gists_archive a WHERE a.rowid = gists.rowid
+                    AND a.event = gists.event AND a.subscription = gists.subscription
+                );
+            COMMIT;
+        ''')
+        return len(rows)
+
+    async def close(self):
+        if self._task: self._task.cancel()
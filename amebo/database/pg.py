@@ -1,8 +1,14 @@
+from asyncpg import Connection
+
+from amebo.utils.helpers import digest
+
+
 pgscript = '''
+-- runs in one transaction with undedupe, the lock keeps nodes of a cluster from migrating at the same time
+SELECT pg_advisory_xact_lock(hashtext('_amebo_'));
+
 CREATE SCHEMA IF NOT EXISTS _amebo_;
 DROP TABLE IF EXISTS _amebo_.credentials;
-DROP TABLE IF EXISTS _amebo_.gists;
-DROP TABLE IF EXISTS _amebo_.subscriptions;
 
 SET search_path TO _amebo_;
     CREATE TABLE IF NOT EXISTS _amebo_.credentials(
@@ -24,9 +30,36 @@ SET search_path TO _amebo_;
         action text primary key,
         application text NOT NULL REFERENCES applications(application),
         schemata text NOT NULL,
+        compression text,  -- gzip or zstd to store large payloads of the action compressed, null for never
         timestamped text NOT NULL
     );
 
+    -- partitioned by day of creation when the `amebo.partition` setting names an interval, only a new install
+    -- can be partitioned as postgres can not partition existing tables. Keys of a partitioned table have to
+    -- include the partition key so gists reference their events without a foreign key
+    CREATE SEQUENCE IF NOT EXISTS _amebo_.events_rowid_seq AS integer;
+    CREATE SEQUENCE IF NOT EXISTS _amebo_.events_event_seq AS integer;
+    CREATE SEQUENCE IF NOT EXISTS _amebo_.gists_rowid_seq AS integer;
+    DO $$ BEGIN
+        IF current_setting('amebo.partition', true) IN ('day', 'week', 'month') THEN
+            CREATE TABLE IF NOT EXISTS _amebo_.events (
+                rowid integer NOT NULL DEFAULT nextval('_amebo_.events_rowid_seq'),
+                event integer NOT NULL DEFAULT nextval('_amebo_.events_event_seq'),
+                action text NOT NULL references actions(action),
+                deduper text NOT NULL,
+                payload text NOT NULL,
+                timestamped text NOT NULL,
+                ordering_key text,
+                encoding text,
+                packed bytea,
+                created date NOT NULL DEFAULT current_date,
+
+                PRIMARY KEY(event, created)
+            ) PARTITION BY RANGE (created);
+            CREATE TABLE IF NOT EXISTS _amebo_.events_default PARTITION OF _amebo_.events DEFAULT;
+        END IF;
+    END $$;
+
     CREATE TABLE IF NOT EXISTS _amebo_.events (
         rowid integer unique generated always as identity,
         event integer primary key generated always as identity,
@@ -34,8 +67,18 @@ SET search_path TO _amebo_;
         deduper text NOT NULL,
         payload text NOT NULL,
         timestamped text NOT NULL,
+        ordering_key text,  -- events sharing a key are delivered to each subscription one at a time in order
+        encoding text,  -- how packed is compressed, payload only holds the digest when it is set
+        packed bytea,  -- the compressed payload
+        created date NOT NULL DEFAULT current_date  -- day the event came in, events and gists are partitioned by it
+    );
 
-        UNIQUE(deduper, payload)
+    -- duplicate events are caught by a fixed width digest of their deduper and payload rather than an index
+    -- over the payload itself, a digest is held until it expires and then taken by the next event with it
+    CREATE TABLE IF NOT EXISTS _amebo_.dedupes (
+        digest bytea primary key,
+        expires timestamptz,  -- null holds it for as long as events are kept
+        created date NOT NULL DEFAULT current_date
     );
 
     CREATE TABLE IF NOT EXISTS _amebo_.subscriptions (
@@ -44,6 +87,14 @@ SET search_path TO _amebo_;
         application text NOT NULL references applications(application),  -- subscribing app i.e. producer
         action text NOT NULL references actions(action),
         max_retries integer not null default 3,
+        max_concurrency integer,  -- concurrent deliveries allowed to the handler, null for no limit
+        backoff_base real NOT NULL DEFAULT 1,  -- seconds to wait after the first failed delivery
+        backoff_multiplier real NOT NULL DEFAULT 2,  -- growth of the wait after every further failure
+        backoff_cap real NOT NULL DEFAULT 300,  -- longest wait between two attempts in seconds
+        backoff_jitter real NOT NULL DEFAULT 0.2,  -- fraction of a wait randomly shaved off
+        batch_size integer NOT NULL DEFAULT 1,  -- gists sent to the handler in one request, 1 sends each alone
+        batch_bytes integer NOT NULL DEFAULT 1048576,  -- most payload bytes sent in one request
+        accept_encoding boolean NOT NULL DEFAULT false,  -- compressed payloads are sent as they are stored
         handler text NOT NULL,
         description text,
         timestamped text NOT NULL,
@@ -51,6 +102,28 @@ SET search_path TO _amebo_;
         UNIQUE(application, action, handler)
     );
 
+    DO $$ BEGIN
+        IF current_setting('amebo.partition', true) IN ('day', 'week', 'month') THEN
+            CREATE TABLE IF NOT EXISTS _amebo_.gists (
+                rowid integer NOT NULL DEFAULT nextval('_amebo_.gists_rowid_seq'),
+                event integer NOT NULL,
+                subscription integer references subscriptions(subscription),
+                completed integer NOT NULL,
+                sleep_until timestamptz,
+                retries integer NOT NULL,
+                leased_by text,
+                lease_until timestamptz,
+                timestamped text NOT NULL,
+                ordering_key text,
+                created date NOT NULL DEFAULT current_date,  -- always the day of its event
+
+                PRIMARY KEY(rowid, created),
+                UNIQUE(event, subscription, created)
+            ) PARTITION BY RANGE (created);
+            CREATE TABLE IF NOT EXISTS _amebo_.gists_default PARTITION OF _amebo_.gists DEFAULT;
+        END IF;
+    END $$;
+
     CREATE TABLE IF NOT EXISTS _amebo_.gists (
         rowid integer primary key generated always as identity,
         event integer references events(event),
@@ -58,10 +131,96 @@ SET search_path TO _amebo_;
         completed integer NOT NULL,
         sleep_until timestamptz,
         retries integer NOT NULL,
+        leased_by text,  -- node delivering the gist
+        lease_until timestamptz,  -- other nodes may claim the gist after this
         timestamped text NOT NULL,
+        ordering_key text,  -- copied from its event so lanes are found without a join
+        created date NOT NULL DEFAULT current_date,  -- always the day of its event
 
         UNIQUE(event, subscription)
     );
 
+    -- finished gists are moved here out of the way of the dispatcher, keeping the id they had
+    CREATE TABLE IF NOT EXISTS _amebo_.gists_archive (
+        rowid integer primary key,
+        event integer NOT NULL,
+        subscription integer NOT NULL,
+        completed integer NOT NULL,
+        retries integer NOT NULL,
+        timestamped text NOT NULL,
+        created date NOT NULL
+    );
+
+    -- columns added after a table was first shipped
+    ALTER TABLE _amebo_.subscriptions ADD COLUMN IF NOT EXISTS max_concurrency integer;
+    ALTER TABLE _amebo_.subscriptions ADD COLUMN IF NOT EXISTS backoff_base real NOT NULL DEFAULT 1;
+    ALTER TABLE _amebo_.subscriptions ADD COLUMN IF NOT EXISTS backoff_multiplier real NOT NULL DEFAULT 2;
+    ALTER TABLE _amebo_.subscriptions ADD COLUMN IF NOT EXISTS backoff_cap real NOT NULL DEFAULT 300;
+    ALTER TABLE _amebo_.subscriptions ADD COLUMN IF NOT EXISTS backoff_jitter real NOT NULL DEFAULT 0.2;
+    ALTER TABLE _amebo_.subscriptions ADD COLUMN IF NOT EXISTS batch_size integer NOT NULL DEFAULT 1;
+    ALTER TABLE _amebo_.subscriptions ADD COLUMN IF NOT EXISTS batch_bytes integer NOT NULL DEFAULT 1048576;
+    ALTER TABLE _amebo_.gists ADD COLUMN IF NOT EXISTS leased_by text;
+    ALTER TABLE _amebo_.gists ADD COLUMN IF NOT EXISTS lease_until timestamptz;
+    ALTER TABLE _amebo_.events ADD COLUMN IF NOT EXISTS created date NOT NULL DEFAULT current_date;
+    ALTER TABLE _amebo_.gists ADD COLUMN IF NOT EXISTS created date NOT NULL DEFAULT current_date;
+    ALTER TABLE _amebo_.events ADD COLUMN IF NOT EXISTS ordering_key text;
+    ALTER TABLE _amebo_.gists ADD COLUMN IF NOT EXISTS ordering_key text;
+    ALTER TABLE _amebo_.actions ADD COLUMN IF NOT EXISTS compression text;
+    ALTER TABLE _amebo_.events ADD COLUMN IF NOT EXISTS encoding text;
+    ALTER TABLE _amebo_.events ADD COLUMN IF NOT EXISTS packed bytea;
+    ALTER TABLE _amebo_.events ALTER COLUMN packed SET STORAGE EXTERNAL;  -- already compressed, toast need not try
+    ALTER TABLE _amebo_.subscriptions ADD COLUMN IF NOT EXISTS accept_encoding boolean NOT NULL DEFAULT false;
+    -- the unique payloads of older installs are dropped by undedupe once their digests are claimed
+
+    -- the dispatcher only ever reads pending gists in event order, delivered ones stay out of its index
+    CREATE INDEX IF NOT EXISTS gists_pending ON _amebo_.gists(event, sleep_until) WHERE completed = 0;
+    CREATE INDEX IF NOT EXISTS gists_subscription ON _amebo_.gists(subscription);
+    CREATE INDEX IF NOT EXISTS events_action ON _amebo_.events(action);
+    CREATE INDEX IF NOT EXISTS subscriptions_action ON _amebo_.subscriptions(action);
+    CREATE INDEX IF NOT EXISTS gists_finished ON _amebo_.gists(rowid) WHERE completed <> 0;
+    -- the earliest pending gist of a lane holds the rest of the lane back
+    CREATE INDEX IF NOT EXISTS gists_lane ON _amebo_.gists(subscription, ordering_key, event)
+        WHERE completed = 0 AND ordering_key IS NOT NULL;
+    CREATE INDEX IF NOT EXISTS gists_archive_created ON _amebo_.gists_archive(created);
+    CREATE INDEX IF NOT EXISTS dedupes_expires ON _amebo_.dedupes(expires) WHERE expires IS NOT NULL;
+
 SET search_path TO public;
 '''
+
+
+# constraints events were once deduplicated by, before and after partitioning
+LEGACY = ('events_deduper_payload_key', 'events_deduper_payload_created_key')
+
+
+async def undedupe(conn: Connection, window: int, batch: int = 10_000):
+    """
+    Claims the digests of events stored while their unique payload turned duplicates down, expiring
+    `window` seconds after each event as though it had just come in, then drops the constraint. A retry
+    of one of them is still a duplicate after the upgrade. Runs in the transaction of pgscript.
+    """
+    legacy = await conn.fetch('''
+        SELECT conname FROM pg_constraint WHERE conrelid = '_amebo_.events'::regclass AND conname = ANY($1::text[]);
+    ''', list(LEGACY))
+    if not legacy: return
+
+    async def claim(rows: list):
+        await conn.execute('''
+            INSERT INTO _amebo_.dedupes(digest, expires, created)
+            SELECT digest, CASE WHEN $4::integer > 0 THEN timestamped::timestamptz + make_interval(secs => $4) END,
+                created
+            FROM unnest($1::bytea[], $2::text[], $3::date[]) AS d(digest, timestamped, created)
+            WHERE $4::integer <= 0 OR timestamped::timestamptz + make_interval(secs => $4) > now()
+            ON CONFLICT (digest) DO NOTHING;
+        ''', *map(list, zip(*rows)), window)
+
+    rows = []
+    async for deduper, payload, encoding, timestamped, created in conn.cursor('''
+        SELECT deduper, payload, encoding, timestamped, created FROM _amebo_.events;
+    ''', prefetch=batch):
+        # a compressed payload column already holds the digest, as hex
+        rows.append((bytes.fromhex(payload) if encoding else digest(deduper, payload), timestamped, created))
+        if len(rows) < batch: continue
+        await claim(rows)
+        rows = []
+    if rows: await claim(rows)
+    for (name, ) in legacy: await conn.execute(f'ALTER TABLE _amebo_.events DROP CONSTRAINT {name};')
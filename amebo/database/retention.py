@@ -0,0 +1,181 @@
+from asyncio import Task, create_task, sleep
+from datetime import date, datetime, timedelta
+from re import compile as regex
+from typing import Optional
+
+from amebo.decorators.providers import Executor
+
+
+INTERVALS = ('day', 'week', 'month')
+TABLES = ('events', 'gists')  # gists are dropped before the events they deliver
+PARTITION = regex(r'^events_(\d{8})$')
+LOCK = "SELECT pg_advisory_xact_lock(hashtext('_amebo_'));"  # the lock initialization takes
+
+
+def floor(interval: str, day: date) -> date:
+    """first day of the partition the day falls in"""
+    if interval == 'week': return day - timedelta(days=day.weekday())
+    if interval == 'month': return day.replace(day=1)
+    return day
+
+
+def following(interval: str, day: date) -> date:
+    """first day of the partition after the one starting on day"""
+    if interval == 'week': return day + timedelta(days=7)
+    if interval == 'month': return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return day + timedelta(days=1)
+
+
+class Retention(object):
+    """
+    Keeps events and gists from growing forever. Partitioned postgres tables get partitions created ahead
+    of time and whole expired partitions dropped, everything else has expired rows deleted in batches.
+    Undelivered gists are never dropped, a partition still holding any is kept until they are done. Digests
+    of events are forgotten once their dedup `window` is over or with the events themselves.
+    """
+    def __init__(
+            self, executor: Executor, interval: str, ahead: int, days: int, every: float, window: int = 0,
+            batch: int = 5000):
+        self.executor = executor
+        self.interval = interval if interval in INTERVALS else ''
+        self.ahead = ahead
+        self.days = days
+        self.every = every
+        self.window = window
+        self.batch = batch
+        self.partitioned: Optional[bool] = None
+        self._task: Task = None
+
+    async def start(self):
+        """maintains once before returning so the partitions of today exist before any event comes in"""
+        await self.maintain()
+        if self.interval or self.days or self.window: self._task = create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await sleep(self.every)
+            await self.maintain()
+
+    async def maintain(self):
+        try:
+            if self.partitioned is None: self.partitioned = await self._partitioned()
+            if self.partitioned: await self.partition()
+            if self.days:
+                await (self.drop() if self.partitioned else self.prune())
+                await self.unarchive()
+            if self.days or self.window: await self.undedupe()
+        except Exception as exc: print('Exception in database maintenance: ', exc)
+
+    async def _partitioned(self) -> bool:
+        if not self.executor.engine.startswith('postgres'): return False
+        row = await self.executor.fetch(1).execute(f'''
+            SELECT count(*) FROM pg_partitioned_table WHERE partrelid = to_regclass('{self.executor.schema}events');
+        ''')
+        partitioned = bool(row and row[0])
+        if self.interval and not partitioned:
+            print('AMEBO_PARTITION only applies to new installs, existing events are pruned with deletes instead')
+        return partitioned
+
+    async def _today(self) -> date:
+        # the database decides what today is as it fills `created` with its own current_date
+        return (await self.executor.fetch(1).execute('SELECT current_date;'))[0]
+
+    async def partition(self):
+        """create the current partition and `ahead` more of both tables"""
+        x, interval = self.executor.schema, self.interval or 'day'
+        start = floor(interval, await self._today())
+        for _ in range(self.ahead + 1):
+            end = following(interval, start)
+            ddl = ''.join(f'''
+                CREATE TABLE IF NOT EXISTS {x}{table}_{start:%Y%m%d} PARTITION OF {x}{table}
+                    FOR VALUES FROM ('{start}') TO ('{end}');
+            ''' for table in TABLES)
+            # fails when rows of this range already sit in the default partition, the others still get made
+            try: await self.executor.fetch(0).execute(LOCK + ddl)
+            except Exception as exc: print(f'Could not create partitions starting {start}: ', exc)
+            start = end
+
+    async def drop(self):
+        """drop every partition that ended more than `days` ago, unless it still has gists to deliver"""
+        x, interval = self.executor.schema, self.interval or 'day'
+        cutoff = await self._today() - timedelta(days=self.days)
+        partitions = await self.executor.fetch(2).execute(f'''
+            SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass('{x}events');
+        ''') or []
+        for (name,) in partitions:
+            matched = PARTITION.match(name)
+            if not matched: continue
+            start = datetime.strptime(matched.group(1), '%Y%m%d').date()
+            if following(interval, start) > cutoff: continue
+            suffix = matched.group(1)
+            pending = await self.executor.fetch(1).execute(f'''
+                SELECT EXISTS (SELECT 1 FROM {x}gists_{suffix} WHERE completed = 0);
+            ''') if await self._exists(f'{x}gists_{suffix}') else None
+            if pending and pending[0]: continue
+            await self.executor.fetch(0).execute(LOCK + ''.join(
+                f'DROP TABLE IF EXISTS {x}{table}_{suffix};' for table in TABLES))
+
+    async def _exists(self, table: str) -> bool:
+        row = await self.executor.fetch(1).execute(f"SELECT to_regclass('{table}') IS NOT NULL;")
+        return bool(row and row[0])
+
+    def _expired(self):
+        """the condition expired rows meet and the cutoff it is compared with"""
+        if self.executor.engine.startswith('postgres'): return 'created < current_date - $1::integer', self.days
+        return 'timestamped < ?', (datetime.now() - timedelta(days=self.days)).isoformat()
+
+    async def _purge(self, sqls: str, *args):
+        """run a batched delete until it comes back short, the batch size is the last argument"""
+        while True:
+            deleted = await self.executor.fetch(0).execute(sqls, *args, self.batch)
+            # asyncpg answers with a status like 'DELETE 12', sqlite with the row count
+            if isinstance(deleted, str): deleted = int(deleted.split()[-1])
+            if not deleted or deleted < self.batch: break
+
+    async def unarchive(self):
+        """archived gists expire like the rest, partitioned or not"""
+        (expired, cutoff), x, p = self._expired(), self.executor.schema, self.executor.esc(2)
+        await self._purge(f'''
+            DELETE FROM {x}gists_archive WHERE rowid IN (
+                SELECT rowid FROM {x}gists_archive WHERE {expired} LIMIT {p}
+            );
+        ''', cutoff)
+
+    async def undedupe(self):
+        x = self.executor.schema
+        if self.window and self.executor.engine.startswith('postgres'): await self._purge(f'''
+            DELETE FROM {x}dedupes WHERE digest IN (SELECT digest FROM {x}dedupes WHERE expires < now() LIMIT $1);
+        ''')
+        elif self.window: await self._purge('''
+            DELETE FROM dedupes WHERE digest IN (SELECT digest FROM dedupes WHERE expires < ? LIMIT ?);
+        ''', datetime.now().isoformat())
+        if not self.days: return
+        (expired, cutoff), p = self._expired(), self.executor.esc(2)
+        await self._purge(f'''
+            DELETE FROM {x}dedupes WHERE digest IN (SELECT digest FROM {x}dedupes WHERE {expired} LIMIT {p});
+        ''', cutoff)
+
+    async def prune(self):
+        """
+        delete finished gists and then events with no gists left, a batch at a time so writers are not held up.
+        the newest row of each stays as sqlite would otherwise hand its id out again, to a gist already in
+        the archive or an event archived gists still point at
+        """
+        (expired, cutoff), x, p = self._expired(), self.executor.schema, self.executor.esc(2)
+        statements = (f'''
+            DELETE FROM {x}gists WHERE rowid IN (
+                SELECT rowid FROM {x}gists WHERE completed <> 0 AND {expired}
+                AND rowid < (SELECT max(rowid) FROM {x}gists) LIMIT {p}
+            );
+        ''', f'''
+            DELETE FROM {x}events WHERE event IN (
+                SELECT e.event FROM {x}events e WHERE {expired}
+                AND e.event < (SELECT max(event) FROM {x}events)
+                AND NOT EXISTS (SELECT 1 FROM {x}gists g WHERE g.event = e.event) LIMIT {p}
+            );
+        ''')
+        for sqls in statements: await self._purge(sqls, cutoff)
+
+    async def close(self):
+        if self._task: self._task.cancel()
@@ -0,0 +1,157 @@
+from asyncio import AbstractEventLoop, Future, get_running_loop
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty, SimpleQueue
+from sqlite3 import Connection, connect
+from threading import Thread, local
+from typing import Any, Callable, List, Optional
+
+
+PRAGMAS = (
+    'PRAGMA busy_timeout = 5000',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -16000',  # kibibytes i.e. 16MB per connection
+    'PRAGMA mmap_size = 134217728',
+)
+READS = ('SELECT', 'EXPLAIN')
+NOTHING = object()
+
+
+class Sqlite(object):
+    """
+    Keeps blocking sqlite calls off the event loop. Writes queue up for one writer thread which commits
+    whatever is waiting as a single transaction (group commit), every write in its own savepoint so one
+    failing does not fail the others, and is only answered once committed. Reads run on a small pool of
+    connections that see committed data, WAL lets them carry on while the writer commits.
+    """
+    def __init__(self, path: str, readers: int = 4, group: int = 256):
+        self.path = path
+        self.group = group
+        self.closed = False
+        self._memory = path == ':memory:'  # a private in memory database can not be shared, all of it is written
+        self._writes: SimpleQueue = SimpleQueue()
+        self._connections: List[Connection] = []
+        self._local = local()
+        self._writer = Thread(target=self._write, args=(self._open(),), name='amebo-sqlite-writer', daemon=True)
+        self._writer.start()
+        self._readers = None if self._memory else ThreadPoolExecutor(readers, thread_name_prefix='amebo-sqlite-reader')
+
+    def _open(self, reader: bool = False) -> Connection:
+        conn = connect(self.path, isolation_level=None, check_same_thread=False)
+        if not self._memory: conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')  # durable at checkpoints, never corrupt under WAL
+        for pragma in PRAGMAS: conn.execute(pragma)
+        if reader: conn.execute('PRAGMA query_only = ON')
+        self._connections.append(conn)
+        return conn
+
+    @property
+    def queued(self) -> int:
+        """writes waiting on the writer thread"""
+        return self._writes.qsize()
+
+    async def execute(self, query: str, args: tuple = (), fetching: int = 0) -> Any:
+        """fetching as with Executor: 0 the row count, 1 a row and more than 1 all rows"""
+        if self.closed: raise RuntimeError('sqlite engine is closed')
+        loop = get_running_loop()
+        if self._readers and query.lstrip().upper().startswith(READS):
+            return await loop.run_in_executor(self._readers, self._read, query, args, fetching)
+        future = loop.create_future()
+        self._writes.put((loop, future, query, args, fetching))
+        return await future
+
+    async def atomic(self, work: Callable[[Connection], Any]) -> Any:
+        """
+        runs work on the writer thread in a savepoint of its own, so all its statements commit together with
+        the group or none of them do when it raises. work must not await anything, it holds up the writer
+        """
+        if self.closed: raise RuntimeError('sqlite engine is closed')
+        loop = get_running_loop()
+        future = loop.create_future()
+        self._writes.put((loop, future, work, (), 0))
+        return await future
+
+    async def script(self, script: str):
+        """runs on its own outside any group as scripts manage their own transactions"""
+        loop = get_running_loop()
+        future = loop.create_future()
+        self._writes.put((loop, future, script, None, None))
+        return await future
+
+    def _read(self, query: str, args: tuple, fetching: int):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None: conn = self._local.conn = self._open(reader=True)
+        return self._run(conn, query, args, fetching)
+
+    @staticmethod
+    def _run(conn: Connection, query: str, args: tuple, fetching: int):
+        cursor = conn.execute(query, args)
+        try:
+            if fetching == 1: return cursor.fetchone()
+            if fetching > 1: return cursor.fetchall()
+            return cursor.rowcount
+        finally: cursor.close()
+
+    @staticmethod
+    def _answer(loop: AbstractEventLoop, future: Future, result: Any = None, exc: Optional[BaseException] = None):
+        def answer():
+            if future.done(): return
+            if exc is None: future.set_result(result)
+            else: future.set_exception(exc)
+        try: loop.call_soon_threadsafe(answer)
+        except RuntimeError: pass  # the loop is gone, nobody is waiting anymore
+
+    def _write(self, conn: Connection):
+        job = self._writes.get()
+        while job is not None:  # none is queued by close
+            loop, future, query, args, fetching = job
+            if args is None:
+                try: conn.executescript(query)
+                except Exception as exc:
+                    if conn.in_transaction: conn.execute('ROLLBACK')  # a script failing halfway leaves it open
+                    self._answer(loop, future, exc=exc)
+                else: self._answer(loop, future)
+                job = self._writes.get()
+                continue
+
+            # everything already waiting joins the group, up to a script or close which go after it
+            group, job = [job], NOTHING
+            while len(group) < self.group:
+                try: queued = self._writes.get_nowait()
+                except Empty: break
+                if queued is None or queued[3] is None:
+                    job = queued
+                    break
+                group.append(queued)
+            self._commit(conn, group)
+            if job is NOTHING: job = self._writes.get()
+        conn.close()
+
+    def _commit(self, conn: Connection, group: list):
+        answers = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for loop, future, query, args, fetching in group:
+                conn.execute('SAVEPOINT write')
+                try:
+                    result = query(conn) if callable(query) else self._run(conn, query, args, fetching)
+                    answers.append((loop, future, result, None))
+                except Exception as exc:
+                    conn.execute('ROLLBACK TO write')
+                    answers.append((loop, future, None, exc))
+                conn.execute('RELEASE write')
+            conn.execute('COMMIT')
+        except Exception as exc:
+            if conn.in_transaction: conn.execute('ROLLBACK')
+            answers = [(loop, future, None, exc) for loop, future, *_ in group]
+        for answer in answers: self._answer(*answer)
+
+    async def close(self):
+        if self.closed: return
+        self.closed = True
+        loop = get_running_loop()
+        self._writes.put(None)
+        await loop.run_in_executor(None, self._writer.join)
+        if self._readers: self._readers.shutdown(wait=True)
+        for conn in self._connections:
+            try: conn.close()
+            except Exception: pass
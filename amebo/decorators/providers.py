@@ -2,6 +2,7 @@ from functools import wraps
 from http import HTTPStatus
 from inspect import iscoroutinefunction
 from sqlite3 import Connection
+from time import perf_counter
 
 from asyncpg import Pool
 from fastjsonschema import compile
@@ -11,6 +12,7 @@ from pydantic import BaseModel
 
 from amebo.utils.structs import Lookup
 from amebo.constants.literals import DB
+from amebo.utils.metrics import QUERY_SECONDS
 
 
 class Executor(object):
@@ -30,49 +32,42 @@ class Executor(object):
         return self
 
     async def _pg(self, query: str, *args):
+        fetching = self._fetching  # read before awaiting as executors are shared by concurrent deliveries
         if self.db is None:
             # Handle case where database connection failed (e.g., in tests)
             print("Warning: PostgreSQL database connection is None, skipping query")
-            if self._fetching == 1: return None
-            if self._fetching > 1: return []
+            if fetching == 1: return None
+            if fetching > 1: return []
             else: return None
 
         async with self.db.acquire() as conn:
             async with conn.transaction():
-                if self._fetching == 1: return await conn.fetchrow(query, *args)
-                if self._fetching > 1: return await conn.fetch(query, *args)
+                if fetching == 1: return await conn.fetchrow(query, *args)
+                if fetching > 1: return await conn.fetch(query, *args)
                 else: return await conn.execute(query, *args)
 
     async def _sqlite(self, query: str, *args: tuple):
-        cursor = self.db.cursor()
-        try:
-            if self._fetching == 1: return cursor.execute(query, args).fetchone()
-            if self._fetching > 1: return cursor.execute(query, args).fetchall()
-            else: return cursor.execute(query, args); self.db.commit()
-        except Exception as exc: raise exc
-        finally: cursor.close()
+        # reads go to a reader connection and writes to the writer thread, neither blocks the event loop
+        return await self.db.execute(query, args, self._fetching)
 
     def esc(self, count: int):
         return '?' if self.engine == 'sqlite' else f'${count}'
 
     @property
     def execute(self, *args, **kwargs):
-        async def acaller(*args, **kwargs):
-            if self.engine == 'sqlite': return await self._sqlite(*args, **kwargs)
-            return await self._pg(*args, **kwargs)
+        async def acaller(query: str, *args, **kwargs):
+            started = perf_counter()
+            try:
+                if self.engine == 'sqlite': return await self._sqlite(query, *args, **kwargs)
+                return await self._pg(query, *args, **kwargs)
+            finally:
+                # labelled by the statement's first word, the engine is a dsn for postgres so only its kind
+                statement = query.split(None, 1)[0].upper() if query.strip() else ''
+                engine = 'sqlite' if self.engine == 'sqlite' else 'postgres'
+                QUERY_SECONDS.observe(perf_counter() - started, engine, statement)
         return acaller
 
 
-def cacheschema(func):
-    @wraps(func)
-    async def delegate(req: Request, res: Response, ctx: Context):
-        if iscoroutinefunction(func): await func(req, res, ctx)
-        else: func(req, res, ctx)
-        if req.app._.schematas.get(ctx.schemata_name): pass
-        else: req.app._.schematas[ctx.schemata_name] = compile(ctx.schemata)
-    return delegate
-
-
 def contextualize(func):
     @wraps(func)
     async def delegate(req: Request, res: Response, ctx: Context):
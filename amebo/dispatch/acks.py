@@ -0,0 +1,132 @@
+from asyncio import Event, TimeoutError, sleep, wait_for
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Dict, Set, Tuple
+
+from amebo.decorators.providers import Executor
+from amebo.dispatch.scheduler import Scheduler
+
+
+# gists.completed
+PENDING, DELIVERED, EXHAUSTED = 0, 1, 2
+DEFERRED = -1  # never written, a gist put back to sleep without an attempt so it keeps its retries
+BACKOFF_CAP = 5  # most seconds waited before writing again after failed flushes
+
+
+class Acknowledger(object):
+    """
+    Buffers delivery outcomes and writes each buffered batch with one parameterized statement, when
+    `size` outcomes are waiting or `interval` seconds after the first one arrived, whichever is sooner.
+    Every outcome is written exactly once, a batch that fails to write is kept for the next flush, which
+    waits longer after every failure in a row.
+    """
+    def __init__(self, executor: Executor, scheduler: Scheduler, node: str, size: int, interval: float):
+        self.executor = executor
+        self.scheduler = scheduler
+        self.node = node
+        self.size = size
+        self.interval = interval
+        self.closed = False
+        self._outcomes: Dict[int, Tuple[int, float]] = {}  # gist -> (completed, seconds to sleep if pending)
+        self._leads: Set[int] = set()
+        self._dirty = Event()
+        self._full = Event()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._outcomes)
+
+    def holds(self, gist: int) -> bool:
+        """outcomes not yet written leave the gist looking pending in the db"""
+        return gist in self._outcomes
+
+    def lead(self, gist: int):
+        """the gist heads an ordered lane, the next in line can only be fetched once it is done"""
+        self._leads.add(gist)
+
+    def accept(self, gist: int):
+        self._buffer(gist, DELIVERED, 0)
+
+    def reject(self, gist: int, delay: float, exhausted: bool = False):
+        self._buffer(gist, EXHAUSTED if exhausted else PENDING, delay)
+
+    def defer(self, gist: int, delay: float):
+        self._buffer(gist, DEFERRED, delay)
+
+    def _buffer(self, gist: int, completed: int, delay: float):
+        self._outcomes[gist] = (completed, delay)
+        self._dirty.set()
+        if len(self._outcomes) >= self.size: self._full.set()
+
+    async def run(self):
+        failures = 0
+        while not self.closed:
+            await self._dirty.wait()
+            try: await wait_for(self._full.wait(), self.interval)
+            except TimeoutError: pass
+            if await self.flush(): failures = 0
+            else:
+                # a full buffer would have the next flush go at once, the database gets time to come back
+                failures += 1
+                await sleep(min(self.interval * 2 ** failures, BACKOFF_CAP))
+
+    async def flush(self) -> bool:
+        """writes a batch, false when it could not and the batch is kept"""
+        if not self._outcomes:
+            self._dirty.clear()
+            return True
+        batch = dict(islice(self._outcomes.items(), self.size))
+        try:
+            if self.executor.engine.startswith('postgres'): await self._pg(batch)
+            else: await self._sqlite(batch)
+        except Exception as exc:
+            print('Could not acknowledge deliveries: ', exc)
+            return False
+
+        # settled before they stop being held so a fetch already in flight can not resubmit them, and
+        # rejections are only due from now as that is when their sleep started in the db
+        self.scheduler.settle(batch)
+        for gist, (completed, delay) in batch.items():
+            if completed in (PENDING, DEFERRED): self.scheduler.snooze(delay)
+            elif gist in self._leads: self.scheduler.wake()  # its lane moves on, fetch the next without idling
+            self._leads.discard(gist)
+            if self._outcomes.get(gist) == (completed, delay): del self._outcomes[gist]
+        if len(self._outcomes) < self.size: self._full.clear()
+        if not self._outcomes: self._dirty.clear()
+        return True
+
+    async def _pg(self, batch: Dict[int, Tuple[int, float]]):
+        # leases are released with the outcome, unless another node claimed the gist after ours lapsed
+        x = self.executor.schema
+        gists, completions, delays = list(batch), *map(list, zip(*batch.values()))
+        await self.executor.fetch(0).execute(f'''
+            UPDATE {x}gists AS g SET
+                completed = greatest(u.completed, {PENDING}),
+                retries = g.retries + CASE WHEN u.completed = {DEFERRED} THEN 0 ELSE 1 END,
+                sleep_until = CASE WHEN u.completed <= {PENDING}
+                    THEN now() + make_interval(secs => u.delay) ELSE g.sleep_until END,
+                leased_by = NULL,
+                lease_until = NULL
+            FROM unnest($1::int[], $2::int[], $3::float8[]) AS u(gist, completed, delay)
+            WHERE g.rowid = u.gist AND g.leased_by = $4;
+        ''', gists, completions, delays, self.node)
+
+    async def _sqlite(self, batch: Dict[int, Tuple[int, float]]):
+        now, values = datetime.now(), []
+        for gist, (completed, delay) in batch.items():
+            sleep_until = (now + timedelta(seconds=delay)).isoformat() if completed <= PENDING else None
+            values.extend((gist, completed, sleep_until))
+        await self.executor.fetch(0).execute(f'''
+            UPDATE gists SET
+                completed = max(u.column2, {PENDING}),
+                retries = gists.retries + CASE WHEN u.column2 = {DEFERRED} THEN 0 ELSE 1 END,
+                sleep_until = COALESCE(u.column3, gists.sleep_until)
+            FROM (VALUES {', '.join(['(?, ?, ?)'] * len(batch))}) AS u
+            WHERE gists.rowid = u.column1;
+        ''', *values)
+
+    async def close(self):
+        self.closed = True
+        self._dirty.set()
+        # everything still buffered is written, a batch at a time, unless the database is failing
+        while self._outcomes and await self.flush(): pass
@@ -0,0 +1,49 @@
+from http import HTTPStatus
+from json import loads
+from typing import Callable, Dict, List, Optional
+
+
+ACCEPTED = (HTTPStatus.OK, HTTPStatus.ACCEPTED)
+
+
+def envelope(payloads: List[bytes]) -> bytes:
+    """payloads are stored json text, so a batch is joined into a json array without parsing any of them"""
+    return b'[' + b','.join(payloads) + b']'
+
+
+def fill(backlog: Dict[int, tuple], subscription: int, first: tuple, size: int, limit: int,
+         deliverable: Callable[[tuple], Optional[tuple]]) -> list:
+    """
+    The first gist and those after it in the backlog for the same subscription, up to `size` of them and
+    `limit` bytes. Payloads are measured as they go out i.e. decompressed, so a gist is made deliverable
+    before it is counted, and one the envelope has no room for stays in the backlog for the next one.
+    """
+    gists, used = [first], len(first[1])
+    for gid in [gid for gid, gist in backlog.items() if gist[1] == subscription]:
+        if len(gists) >= size: break
+        gist = deliverable(backlog[gid])
+        if gist is None:
+            backlog.pop(gid)  # exhausted or deferred
+            continue
+        if used + len(gist[1]) + 1 > limit: break  # and a comma
+        used += len(gist[1]) + 1
+        gists.append(gist)
+        backlog.pop(gid)
+    return gists
+
+
+def acknowledged(body: bytes, size: int) -> List[bool]:
+    """
+    Which gists of a batch the subscriber took, read from a 207 answer listing a result per gist e.g.
+    [{"item": 0, "status": 200}, {"item": 1, "status": 503}]. Without `item` results go in the order the
+    gists were sent, a gist with no result or one that can not be read is rejected and retried.
+    """
+    accepted = [False] * size
+    try: results = loads(body)
+    except ValueError: return accepted
+    if not isinstance(results, list): return accepted
+    for position, result in enumerate(results):
+        if not isinstance(result, dict): continue
+        item = result.get('item', position)
+        if isinstance(item, int) and 0 <= item < size: accepted[item] = result.get('status') in ACCEPTED
+    return accepted
@@ -0,0 +1,74 @@
+from time import monotonic
+from typing import Dict
+from urllib.parse import urlsplit
+
+
+CLOSED, HALF_OPEN, OPEN = 'closed', 'half-open', 'open'
+
+
+def hostof(endpoint: str) -> str:
+    return urlsplit(endpoint).netloc
+
+
+class Breaker(object):
+    __slots__ = ('state', 'failures', 'opened', 'probes', 'probed')
+
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0  # in a row
+        self.opened = 0.0
+        self.probes = 0  # deliveries let through while half open and not answered yet
+        self.probed = 0.0
+
+
+class Breakers(object):
+    """
+    A circuit breaker per subscriber host, as seen by this node. `threshold` failed deliveries in a row
+    open it and the host's gists are put back to sleep without an attempt, so no retry is used up. After
+    `cooldown` seconds it is half open and lets `probes` deliveries through, a success closes it and a
+    failure opens it again. A threshold of 0 never opens any.
+    """
+    def __init__(self, threshold: int, cooldown: float, probes: int = 1):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.probes = probes
+        self._breakers: Dict[str, Breaker] = {}
+
+    def state(self, host: str) -> str:
+        breaker = self._breakers.get(host)
+        if breaker is None: return CLOSED
+        if breaker.state == OPEN and monotonic() - breaker.opened >= self.cooldown: breaker.state = HALF_OPEN
+        return breaker.state
+
+    def states(self) -> Dict[str, str]:
+        return {host: self.state(host) for host in self._breakers}
+
+    def allow(self, host: str) -> bool:
+        """whether a delivery to the host may go ahead, counts it as a probe when half open"""
+        state = self.state(host)
+        if state == CLOSED: return True
+        if state == OPEN: return False
+        breaker = self._breakers[host]
+        # a probe that never answered, e.g. cancelled on shutdown, does not hold the breaker half open forever
+        if breaker.probes >= self.probes and monotonic() - breaker.probed < self.cooldown: return False
+        breaker.probes += 1
+        breaker.probed = monotonic()
+        return True
+
+    def wait(self, host: str) -> float:
+        """seconds a gist held back by the breaker should sleep for"""
+        breaker = self._breakers.get(host)
+        if breaker is None: return 0
+        if self.state(host) == OPEN: return max(self.cooldown - (monotonic() - breaker.opened), 0)
+        return min(self.cooldown, 5)  # half open, check back soon after the probe has answered
+
+    def succeeded(self, host: str):
+        self._breakers.pop(host, None)  # closed breakers are not kept
+
+    def failed(self, host: str):
+        if self.threshold <= 0: return
+        breaker = self._breakers.get(host)
+        if breaker is None: breaker = self._breakers[host] = Breaker()
+        breaker.failures += 1
+        if self.state(host) == HALF_OPEN or breaker.failures >= self.threshold:
+            breaker.state, breaker.opened, breaker.probes = OPEN, monotonic(), 0
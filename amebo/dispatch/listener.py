@@ -0,0 +1,57 @@
+from asyncio import create_task, sleep
+from typing import Callable, Dict
+
+from asyncpg import Connection, connect
+
+
+class Listener(object):
+    """
+    A dedicated postgres connection LISTENing on a few channels, it is not taken from the pool as a
+    pooled connection would be reset on release. When the connection drops it is re-established in
+    the background and polling covers whatever was missed in the meantime.
+    """
+    def __init__(self, dsn: str, channels: Dict[str, Callable[[str], None]], retry: float = 5):
+        self.dsn = dsn
+        self.channels = channels
+        self.retry = retry
+        self.closed = False
+        self._conn: Connection = None
+
+    @property
+    def listening(self) -> bool:
+        return self._conn is not None and not self._conn.is_closed()
+
+    async def start(self):
+        if self.closed: return
+        try:
+            self._conn = await connect(self.dsn)
+            self._conn.add_termination_listener(self._terminated)
+            for channel in self.channels: await self._conn.add_listener(channel, self._received)
+        except Exception as exc:
+            print(f'Could not listen for notifications, polling only for now: {exc}')
+            # a connection that came up but could not listen would be leaked by every retry, it is closed
+            # without telling _terminated as the retry is scheduled here
+            if self._conn is not None:
+                self._conn.remove_termination_listener(self._terminated)
+                try: await self._conn.close(timeout=self.retry)
+                except Exception: pass
+                self._conn = None
+            create_task(self._restart())
+
+    async def _restart(self):
+        await sleep(self.retry)
+        await self.start()
+        # anything notified while we were away was missed so every channel is told to catch up
+        if self.listening:
+            for channel in self.channels: self._received(self._conn, 0, channel, '')
+
+    def _received(self, conn: Connection, pid: int, channel: str, payload: str):
+        try: self.channels[channel](payload)
+        except Exception as exc: print(f'Exception handling {channel} notification: ', exc)
+
+    def _terminated(self, conn: Connection):
+        if not self.closed: create_task(self._restart())
+
+    async def close(self):
+        self.closed = True
+        if self.listening: await self._conn.close()
@@ -0,0 +1,65 @@
+"""
+The statements on the dispatch hot path, kept apart so the indexes shipped with the schema can be
+checked against exactly what the dispatcher runs i.e. see tests/test_indexes.py. Where a gist goes is
+looked up in the routes cache (amebo/dispatch/routes.py) so only gists and events are read here.
+"""
+
+
+def forwardable(engine: str, column: str = 'e.payload') -> str:
+    """stored json text read back as the exact bytes a subscriber is sent, nothing is parsed on the way out"""
+    if engine.startswith('postgres'): return f"convert_to({column}, 'UTF8')"
+    return f'CAST({column} AS BLOB)'
+
+
+def packable(engine: str) -> str:
+    """the bytes a subscriber is sent, compressed as e.encoding says when the event was stored compressed"""
+    return f'COALESCE(e.packed, {forwardable(engine)})'
+
+
+def lanescript(x: str) -> str:
+    """only the earliest pending gist of a subscription's lane can go out, gists without a key have no lane"""
+    return f'''(g.ordering_key IS NULL OR NOT EXISTS (
+            SELECT 1 FROM {x}gists AS ahead
+            WHERE ahead.subscription = g.subscription AND ahead.ordering_key = g.ordering_key
+            AND ahead.completed = 0 AND ahead.event < g.event
+        ))'''
+
+
+def claimscript(x: str) -> str:
+    """postgres: $1 node, $2 limit, $3 lease in seconds"""
+    return f'''
+        WITH claimable AS (
+            SELECT g.rowid, g.created FROM {x}gists AS g
+            WHERE g.completed = 0
+            AND (g.sleep_until IS NULL OR g.sleep_until < now())
+            AND (g.lease_until IS NULL OR g.lease_until < now())
+            AND {lanescript(x)}
+            ORDER BY g.event LIMIT $2
+            FOR UPDATE SKIP LOCKED
+        ), claimed AS (
+            UPDATE {x}gists AS g SET
+                leased_by = $1, lease_until = now() + make_interval(secs => $3)
+            FROM claimable c, {x}events e
+            WHERE g.rowid = c.rowid AND g.created = c.created
+            AND e.event = g.event AND e.created = g.created  -- lets partitioned tables prune to one partition
+            RETURNING
+                g.rowid AS gid, g.subscription, g.retries, {packable('postgres')} AS payload, e.encoding,
+                g.ordering_key IS NOT NULL AS ordered, g.event
+        )
+        SELECT gid, subscription, retries, payload, ordered, encoding FROM claimed ORDER BY event;
+    '''
+
+
+def pendingscript(x: str) -> str:
+    """sqlite: ? now as iso text, ? limit"""
+    return f'''
+        SELECT
+            g.rowid AS gid, g.subscription, g.retries, {packable('sqlite')} AS payload,
+            g.ordering_key IS NOT NULL AS ordered, e.encoding
+        FROM {x}gists AS g JOIN {x}events e ON
+            g.event = e.event
+        WHERE g.completed = 0
+        AND (g.sleep_until IS NULL OR g.sleep_until < ?)
+        AND {lanescript(x)}
+        ORDER BY g.event LIMIT ?;
+    '''
@@ -0,0 +1,13 @@
+from random import random
+
+
+def backoff(retries: int, base: float, multiplier: float, cap: float, jitter: float) -> float:
+    """
+    seconds to wait before the next attempt of a gist that has failed `retries` times before this one,
+    jitter is the fraction of the delay that may be shaved off at random so retries of many gists
+    rejected together do not all land on a recovering subscriber at the same moment
+    """
+    # the policy columns are floats and a float power overflows long before max_retries runs out
+    try: delay = min(cap, base * (multiplier ** retries))
+    except OverflowError: delay = cap
+    return delay * (1 - jitter * random())
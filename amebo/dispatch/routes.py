@@ -0,0 +1,71 @@
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from heaven import App
+
+from amebo.constants.literals import JSON_HEADERS, PASS_HEADER, ROUTES, ROUTES_CHANNEL
+from amebo.decorators.providers import Executor
+
+
+class Route(NamedTuple):
+    endpoint: str
+    headers: dict
+    concurrency: Optional[int]
+    max_retries: int
+    policy: Tuple[float, float, float, float]  # backoff base, multiplier, cap and jitter
+    batch: Tuple[int, int]  # most gists and payload bytes sent in one request
+    encoded: bool  # takes compressed payloads as stored, with a Content-Encoding header
+
+
+class Routes(object):
+    """
+    Where and how the gists of every subscription are delivered, kept in memory so the dispatcher only
+    reads gists and events. Every invalidation bumps the version and the next refresh reloads the table,
+    an invalidation that lands while a reload is running leaves the routes stale for the refresh after.
+    """
+    def __init__(self):
+        self.version = 0
+        self._loaded = -1
+        self._routes: Dict[int, Route] = {}
+
+    @property
+    def stale(self) -> bool:
+        return self._loaded != self.version
+
+    def get(self, subscription: int) -> Optional[Route]:
+        return self._routes.get(subscription)
+
+    def invalidate(self, *args):
+        self.version += 1
+
+    async def refresh(self, executor: Executor):
+        if not self.stale: return
+        version = self.version
+        x = executor.schema
+        rows = await executor.fetch(2).execute(f'''
+            SELECT
+                s.subscription, s.handler, a.secret, s.max_concurrency, s.max_retries, s.batch_size, s.batch_bytes,
+                s.accept_encoding, s.backoff_base, s.backoff_multiplier, s.backoff_cap, s.backoff_jitter
+            FROM {x}subscriptions AS s JOIN {x}applications a ON
+                s.application = a.application;
+        ''') or []
+        headers = {}  # one shared dict per secret
+        self._routes = {
+            subscription: Route(
+                endpoint,
+                headers.setdefault(secret, {**JSON_HEADERS, PASS_HEADER: secret}),
+                concurrency,
+                max_retries,
+                tuple(policy),
+                (batch_size, batch_bytes),
+                bool(encoded))
+            for subscription, endpoint, secret, concurrency, max_retries, batch_size, batch_bytes, encoded, *policy in rows
+        }
+        self._loaded = version
+
+
+async def reroute(app: App, executor: Executor):
+    """call after subscriptions or applications change, other nodes hear of it once the change is committed"""
+    routes: Routes = app.peek(ROUTES)
+    if routes is not None: routes.invalidate()
+    if executor.engine.startswith('postgres'):
+        await executor.fetch(0).execute(f"SELECT pg_notify('{ROUTES_CHANNEL}', '');")
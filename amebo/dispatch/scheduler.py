@@ -0,0 +1,129 @@
+from asyncio import Event, Semaphore, Task, TimeoutError, create_task, gather, wait_for
+from contextlib import asynccontextmanager
+from heapq import heappop, heappush
+from time import monotonic
+from typing import Awaitable, Callable, Dict, Hashable, Iterable, List, Set, Tuple
+from urllib.parse import urlsplit
+
+
+class Limiter(object):
+    """counting semaphores created on demand per key and dropped once nobody holds or waits on them"""
+    def __init__(self):
+        self._gates: Dict[Hashable, Semaphore] = {}
+        self._users: Dict[Hashable, int] = {}
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable, limit: int):
+        gate = self._gates.get(key)
+        if gate is None: gate = self._gates[key] = Semaphore(limit)
+        self._users[key] = self._users.get(key, 0) + 1
+        try:
+            async with gate: yield
+        finally:
+            self._users[key] -= 1
+            if not self._users[key]:
+                del self._users[key]
+                del self._gates[key]
+
+
+class Scheduler(object):
+    """
+    Admits at most `capacity` gists at a time and lets at most `inflight` of them talk to subscribers
+    concurrently, with further caps per subscription and per subscriber host. A finished gist frees its
+    slot immediately so the dispatcher can refill it without waiting on the slowest gist in an envelope.
+    Gists delivered together in one request share a task and take one slot between them.
+    """
+    def __init__(self, capacity: int, inflight: int, per_host: int):
+        self.capacity = capacity
+        self.per_host = per_host
+        self._slots = Semaphore(inflight)
+        self._hosts = Limiter()
+        self._subscriptions = Limiter()
+        self._tasks: Dict[int, Task] = {}
+        self._settled: Set[int] = set()
+        self._vacancy = Event()
+        self._vacancy.set()
+        self._wake = Event()
+        self._nudge = Event()
+        self._dues = []  # heap of monotonic times rejected gists fall due again
+        self.closed = False
+
+    @property
+    def vacancies(self) -> int:
+        return max(self.capacity - len(self._tasks), 0)
+
+    @property
+    def pending(self) -> int:
+        return len(self._tasks)
+
+    @property
+    def submitted(self) -> List[int]:
+        return list(self._tasks)
+
+    async def vacancy(self):
+        while not self.vacancies and not self.closed:
+            self._vacancy.clear()
+            await self._vacancy.wait()
+
+    async def idle(self, seconds: float):
+        """rest when there is nothing to deliver, cut short by wake, close or a retry falling due"""
+        until = monotonic() + seconds
+        while not self.closed and not self._wake.is_set():
+            timeout = min([until, *self._dues[:1]]) - monotonic()
+            if timeout <= 0: break
+            self._nudge.clear()
+            try: await wait_for(self._nudge.wait(), timeout)
+            except TimeoutError: pass
+        self._wake.clear()
+        while self._dues and self._dues[0] <= monotonic(): heappop(self._dues)
+
+    def wake(self):
+        self._wake.set()
+        self._nudge.set()
+
+    def snooze(self, seconds: float):
+        """a gist will be due again in `seconds` so do not rest past that"""
+        due = monotonic() + seconds
+        if not self._dues or due < self._dues[0]: self._nudge.set()
+        heappush(self._dues, due)
+
+    def mark(self):
+        """call before fetching gists - anything settled before now has already been written to the db"""
+        self._settled.clear()
+
+    def settle(self, gists: Iterable[int]):
+        """outcomes of these gists were just written, a fetch running since before then may still see them"""
+        self._settled.update(gists)
+
+    def running(self, gist: int) -> bool:
+        return gist in self._tasks
+
+    def busy(self, gist: int) -> bool:
+        """gists still being delivered, or settled while a fetch was running, must not be submitted again"""
+        return gist in self._tasks or gist in self._settled
+
+    def submit(self, gists: Tuple[int, ...], subscription: int, limit: int, endpoint: str, job: Callable[[], Awaitable]):
+        """the number of gists submitted, none when any of them is still being delivered"""
+        if any(self.running(gist) for gist in gists): return 0
+        host = urlsplit(endpoint).netloc
+        task = create_task(self._run(gists, subscription, limit or self.capacity, host, job))
+        for gist in gists: self._tasks[gist] = task
+        return len(gists)
+
+    async def _run(self, gists: Tuple[int, ...], subscription: int, limit: int, host: str, job: Callable[[], Awaitable]):
+        try:
+            async with self._subscriptions.hold(subscription, limit):
+                async with self._hosts.hold(host, self.per_host):
+                    async with self._slots: await job()
+        except Exception as exc: print('Exception occured in dispatch: ', exc)
+        finally:
+            for gist in gists: self._tasks.pop(gist, None)
+            self._vacancy.set()
+
+    async def close(self):
+        self.closed = True
+        self._vacancy.set()
+        self.wake()
+        tasks = list(set(self._tasks.values()))
+        for task in tasks: task.cancel()
+        await gather(*tasks, return_exceptions=True)
@@ -1,18 +1,23 @@
 from inspect import iscoroutinefunction
 from os import environ
-from sqlite3 import Connection
+from sqlite3 import Connection, OperationalError
 
 from heaven import Application
 from asyncpg import create_pool
 
-from amebo.constants.literals import DB
-from amebo.constants.scripts import initdbscript
+from amebo.constants.literals import ARCHIVER, DB, RETENTION, SCHEMATAS
+from amebo.constants.scripts import initdbscript, migrationscripts
+from amebo.decorators.providers import Executor
+from amebo.utils.registry import Registry
 from amebo.utils.structs import Lookup
-from amebo.database.pg import pgscript
+from amebo.database.archive import Archiver
+from amebo.database.pg import pgscript, undedupe
+from amebo.database.retention import INTERVALS, Retention
+from amebo.database.sqlite import Sqlite
 
 
 ENGINES = {
-    'sqlite': lambda *args: Connection(*args),
+    'sqlite': lambda *args: Sqlite(*args),
     'postgres': lambda *args: create_pool(*args)
 }
 
@@ -23,14 +28,14 @@ async def connect(app: Application):
     db = None
     try:
         if engine.startswith('postgres'): db = await create_pool(environ.get('AMEBO_DSN'))
-        else: db = Connection('amebo.db')
+        else: db = Sqlite('amebo.db', app.CONFIG('sqlite_readers'), app.CONFIG('sqlite_group'))
     except Exception as exc:
         print(f'connection middleware failed: {exc}')
         # Set a default connection for testing environments
         if engine.startswith('postgres'):
             db = None  # Will be handled by Executor
         else:
-            db = Connection(':memory:')  # In-memory SQLite for tests
+            db = Sqlite(':memory:')  # In-memory SQLite for tests
     app.keep(DB, db)
 
 
@@ -45,15 +50,51 @@ async def disconnect(app: Application):
 async def initialize(app: Application):
     """todo: enable switching db backend between redis, pg, sqlite"""
     if app._.engine.startswith('postgres'):
-        await app.peek(DB).execute(pgscript)
+        # only a name from INTERVALS reaches the script, the setting lasts as long as its transaction
+        interval = app.CONFIG('partition') if app.CONFIG('partition') in INTERVALS else ''
+        async with app.peek(DB).acquire() as conn, conn.transaction():
+            await conn.execute(f"SELECT set_config('amebo.partition', '{interval}', true);" + pgscript)
+            await undedupe(conn, app.CONFIG('dedup_window'))
     else:
-        try:
-            db: Connection = app.peek(DB)
-            db.executescript(initdbscript)
+        db: Sqlite = app.peek(DB)
+        try: await db.script(initdbscript)
         except Exception as exc:
             print('Exception in initdb hook: ', exc)
+        for migration in migrationscripts:
+            try: await db.execute(migration)
+            except OperationalError: pass  # column already exists
+
+
+async def maintain(app: Application):
+    retention = Retention(
+        Executor(app),
+        interval=app.CONFIG('partition'),
+        ahead=app.CONFIG('partitions_ahead'),
+        days=app.CONFIG('retention'),
+        every=app.CONFIG('maintenance'),
+        window=app.CONFIG('dedup_window')
+    )
+    app.keep(RETENTION, retention)
+    await retention.start()
+    archiver = Archiver(Executor(app), batch=app.CONFIG('archive_batch'), interval=app.CONFIG('archive_interval'))
+    app.keep(ARCHIVER, archiver)
+    archiver.start()
+
+
+async def unmaintain(app: Application):
+    retention: Retention = app.peek(RETENTION)
+    if retention is not None: await retention.close()
+    archiver: Archiver = app.peek(ARCHIVER)
+    if archiver is not None: await archiver.close()
 
 
 def cache(app: Application):
     app._.tokens = {}
-    app._.schematas = {}
+    app._.schematas = Registry(app.CONFIG('schema_cache'))
+
+
+async def warm(app: Application):
+    """compile the schemas of existing actions up front so even the first events skip the db"""
+    registry: Registry = app.peek(SCHEMATAS)
+    try: await registry.load(Executor(app))
+    except Exception as exc: print('Could not warm the schema registry: ', exc)
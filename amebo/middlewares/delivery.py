@@ -0,0 +1,90 @@
+from os import environ
+
+from heaven import Application
+from httpx import AsyncClient, Limits, Timeout
+
+from amebo.constants.literals import (
+    ACKS, ACTIONS_CHANNEL, BREAKERS, CLIENT, GISTS_CHANNEL, LISTENER, ROUTES, ROUTES_CHANNEL, SCHEDULER, SCHEMATAS)
+from amebo.decorators.providers import Executor
+from amebo.dispatch.acks import Acknowledger
+from amebo.dispatch.breakers import Breakers
+from amebo.dispatch.listener import Listener
+from amebo.dispatch.routes import Routes
+from amebo.dispatch.scheduler import Scheduler
+from amebo.utils.registry import Registry
+
+
+def dialer(app: Application) -> AsyncClient:
+    """one long lived client i.e. keep-alive connection pools are kept per subscriber origin by httpx"""
+    limits = Limits(
+        max_connections=app.CONFIG('pool_size'),
+        max_keepalive_connections=app.CONFIG('keepalives'),
+        keepalive_expiry=app.CONFIG('keepalive_expiry')
+    )
+    timeout = Timeout(app.CONFIG('timeout'), connect=app.CONFIG('connect_timeout'))
+    if app.CONFIG('http2'):
+        # http2 multiplexing needs the optional h2 package i.e. pip install amebo[http2]
+        try: return AsyncClient(http2=True, limits=limits, timeout=timeout)
+        except ImportError as exc: print(f'HTTP/2 delivery disabled, falling back to HTTP/1.1: {exc}')
+    return AsyncClient(limits=limits, timeout=timeout)
+
+
+async def connect(app: Application):
+    app.keep(CLIENT, dialer(app))
+    scheduler = Scheduler(
+        capacity=app.CONFIG('envelope_size'),
+        inflight=app.CONFIG('inflight'),
+        per_host=app.CONFIG('host_concurrency')
+    )
+    app.keep(SCHEDULER, scheduler)
+    app.keep(ROUTES, Routes())
+    app.keep(BREAKERS, Breakers(app.CONFIG('breaker_threshold'), app.CONFIG('breaker_cooldown')))
+    app.keep(ACKS, Acknowledger(
+        Executor(app),
+        scheduler,
+        node=app.CONFIG('node'),
+        size=app.CONFIG('ack_size'),
+        interval=app.CONFIG('ack_interval')
+    ))
+
+
+async def listen(app: Application):
+    """wake the dispatcher the moment any node fans out new gists, and drop what changed from the caches"""
+    if not app._.engine.startswith('postgres'): return
+    scheduler: Scheduler = app.peek(SCHEDULER)
+    routes: Routes = app.peek(ROUTES)
+    registry: Registry = app.peek(SCHEMATAS)
+    listener = Listener(environ.get('AMEBO_DSN'), {
+        ACTIONS_CHANNEL: lambda action: registry.invalidate(action or None),
+        GISTS_CHANNEL: lambda payload: scheduler.wake(),
+        ROUTES_CHANNEL: routes.invalidate
+    })
+    app.keep(LISTENER, listener)
+    await listener.start()
+
+
+async def unlisten(app: Application):
+    listener: Listener = app.peek(LISTENER)
+    if listener is not None: await listener.close()
+
+
+async def disconnect(app: Application):
+    # unfinished deliveries are abandoned before the client closes, they stay pending and are retried later
+    scheduler: Scheduler = app.peek(SCHEDULER)
+    if scheduler is not None: await scheduler.close()
+    acks: Acknowledger = app.peek(ACKS)
+    if acks is not None: await acks.close()
+
+    # hand gists this node claimed but did not finish straight back to the cluster
+    executor = Executor(app)
+    if executor.engine.startswith('postgres') and executor.db is not None:
+        try:
+            await executor.fetch(0).execute(f'''
+                UPDATE {executor.schema}gists SET leased_by = NULL, lease_until = NULL WHERE leased_by = $1;
+            ''', app.CONFIG('node'))
+        except Exception as exc: print('Could not release leases on shutdown: ', exc)
+
+    client: AsyncClient = app.peek(CLIENT)
+    if client is None: return
+    try: await client.aclose()
+    except Exception as exc: print('Exception in closing delivery client on shutdown: ', exc)
@@ -13,7 +13,7 @@ async def cors(req, res: Response, ctx):
     res.headers = 'Access-Control-Allow-Credentials', 'true'
     res.headers = 'Access-Control-Allow-Headers', f'Accept, Content-Type, Content-Disposition, Authorization, Authentication, Vary, Date, Accept-Encoding, X-CSRF-Token, X-Hint, X-Hosted, Set-Cookie, X-Form-ID, {hx_req_headers}'
     res.headers = 'Access-Control-Allow-Methods', 'GET, POST, PUT, PATCH, DELETE, OPTIONS'
-    res.headers = 'Access-Control-Expose-Headers', f'X-Hint, X-Hosted, X-Other, Set-Cookie, X-Form-ID, HX-History-Restore-Request, {hx_res_headers}'
+    res.headers = 'Access-Control-Expose-Headers', f'X-Hint, X-Hosted, X-Next-Cursor, X-Amebo-Warning, X-Other, Set-Cookie, X-Form-ID, HX-History-Restore-Request, {hx_res_headers}'
 
 
 async def upsudo(app: Application) -> str:
@@ -33,7 +33,7 @@ async def upsudo(app: Application) -> str:
                 INSERT INTO _amebo_.credentials(username, password) VALUES($1, $2)
                     ON CONFLICT(username) DO UPDATE SET password = EXCLUDED.password;
             ''', username, password.decode())
-        else: db.execute('INSERT INTO credentials VALUES(?, ?);', (username, password.decode()))
+        else: await db.execute('INSERT INTO credentials VALUES(?, ?);', (username, password.decode()))
     except Exception as exc:
         print("SUDO Credentials not created....")
         print('*' * 100, f': {exc}')
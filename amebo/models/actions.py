@@ -1,6 +1,6 @@
 from datetime import datetime
 from json import loads
-from typing import Optional, Union
+from typing import Literal, Optional, Union
 
 from pydantic import AnyHttpUrl
 from pydantic import BaseModel as Model
@@ -12,6 +12,7 @@ class Action(Model):
     application: str
     schemata: Union[dict, str]
     secret: str
+    compression: Optional[Literal['gzip', 'zstd']] = None
     timestamped: datetime = Field(default_factory=datetime.now)
 
     @classmethod
@@ -13,6 +13,7 @@ class Events(Model):
     event: Optional[int] = None
     deduper: str
     sleep_until: Optional[int]  # number of seconds to sleep until
+    ordering_key: Optional[str] = None  # events with the same key reach each subscriber one by one in order
     payload: Union[str, dict]
     timestamped: datetime = Field(default_factory=datetime.now)
 
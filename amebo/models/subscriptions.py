@@ -16,6 +16,14 @@ class Subscriptions(Model):
     handler: str
     secret: str
     max_retries: Optional[int] = Field(le=10_000, ge=1, default=3)
+    max_concurrency: Optional[int] = Field(le=10_000, ge=1, default=None)
+    backoff_base: float = Field(ge=0, le=86_400, default=1)
+    backoff_multiplier: float = Field(ge=1, le=100, default=2)
+    backoff_cap: float = Field(ge=0, le=86_400, default=300)
+    backoff_jitter: float = Field(ge=0, le=1, default=0.2)
+    batch_size: int = Field(ge=1, le=1000, default=1)
+    batch_bytes: int = Field(ge=1024, le=16_777_216, default=1_048_576)
+    accept_encoding: bool = False
     timestamped: datetime = Field(default_factory=datetime.now)
 
     @field_validator('handler')
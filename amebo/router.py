@@ -1,4 +1,5 @@
 from os import environ
+from socket import gethostname
 from uuid import uuid4
 
 # installed libs
@@ -16,6 +17,32 @@ router = Application({
     'envelope_size': int(environ.get('AMEBO_ENVELOPE') or 256),  # how many tasks to fetch at once for processing
     'idles': 5,  # sleep for 5 seconds
     'rest_when': 0,  # reduce frequency of daemons when tasks less than 5
+    'http2': (environ.get('AMEBO_HTTP2') or '').lower() in ('1', 'true', 'yes'),  # multiplex deliveries per origin
+    'pool_size': int(environ.get('AMEBO_POOL_SIZE') or 100),  # max open connections across all subscribers
+    'keepalives': int(environ.get('AMEBO_KEEPALIVES') or 20),  # idle connections kept warm for reuse
+    'keepalive_expiry': float(environ.get('AMEBO_KEEPALIVE_EXPIRY') or 30),  # seconds an idle connection is kept
+    'timeout': float(environ.get('AMEBO_TIMEOUT') or 10),  # seconds to wait on a subscriber
+    'connect_timeout': float(environ.get('AMEBO_CONNECT_TIMEOUT') or 5),
+    'inflight': int(environ.get('AMEBO_INFLIGHT') or 64),  # max deliveries talking to subscribers at once
+    'host_concurrency': int(environ.get('AMEBO_HOST_CONCURRENCY') or 16),  # max concurrent deliveries per host
+    'node': environ.get('AMEBO_NODE') or f'{gethostname()}-{uuid4().hex[:8]}',  # identifies this instance's leases
+    'lease': float(environ.get('AMEBO_LEASE') or 60),  # seconds before a crashed node's gists can be claimed again
+    'breaker_threshold': int(environ.get('AMEBO_BREAKER_THRESHOLD') or 5),  # failures in a row before a host is paused, 0 never
+    'breaker_cooldown': float(environ.get('AMEBO_BREAKER_COOLDOWN') or 30),  # seconds a paused host is left alone
+    'ack_size': int(environ.get('AMEBO_ACK_SIZE') or 256),  # delivery outcomes written per statement
+    'ack_interval': float(environ.get('AMEBO_ACK_INTERVAL') or 0.05),  # seconds an outcome may wait to be written
+    'schema_cache': int(environ.get('AMEBO_SCHEMA_CACHE') or 1024),  # compiled action schemas kept in memory
+    'batch_size': int(environ.get('AMEBO_BATCH_SIZE') or 1000),  # max events accepted by one batch request
+    'dedup_window': int(environ.get('AMEBO_DEDUP_WINDOW') or 0),  # seconds a duplicate is turned down for, 0 always
+    'compress_over': int(environ.get('AMEBO_COMPRESS_OVER') or 1024),  # payload size from which actions compress
+    'sqlite_readers': int(environ.get('AMEBO_SQLITE_READERS') or 4),  # connections serving reads concurrently
+    'sqlite_group': int(environ.get('AMEBO_SQLITE_GROUP') or 256),  # max writes committed in one transaction
+    'partition': (environ.get('AMEBO_PARTITION') or '').lower(),  # day, week or month partitions on new installs
+    'partitions_ahead': int(environ.get('AMEBO_PARTITIONS_AHEAD') or 3),  # partitions created ahead of time
+    'retention': int(environ.get('AMEBO_RETENTION') or 0),  # days events are kept, 0 keeps them forever
+    'maintenance': float(environ.get('AMEBO_MAINTENANCE') or 3600),  # seconds between retention runs
+    'archive_batch': int(environ.get('AMEBO_ARCHIVE_BATCH') or 1000),  # finished gists archived at once, 0 never
+    'archive_interval': float(environ.get('AMEBO_ARCHIVE_INTERVAL') or 1),  # seconds between archive batches
     AMEBO_SECRET: environ.get('AMEBO_SECRET') or deterministic_uuid()
 })
 
@@ -29,8 +56,15 @@ router.TEMPLATES('templates', relative_to=__file__)
 # set up hooks
 router.ON(STARTUP, 'amebo.middlewares.database.connect')
 router.ON(STARTUP, 'amebo.middlewares.database.cache')
+router.ON(STARTUP, 'amebo.middlewares.delivery.connect')
+router.ON(STARTUP, 'amebo.middlewares.delivery.listen')
+router.ON(SHUTDOWN, 'amebo.middlewares.delivery.unlisten')
+router.ON(SHUTDOWN, 'amebo.middlewares.delivery.disconnect')  # before the db closes so leases can be released
+router.ON(SHUTDOWN, 'amebo.middlewares.database.unmaintain')
 router.ON(SHUTDOWN, 'amebo.middlewares.database.disconnect')
 router.ON(STARTUP, 'amebo.middlewares.database.initialize')
+router.ON(STARTUP, 'amebo.middlewares.database.maintain')
+router.ON(STARTUP, 'amebo.middlewares.database.warm')
 router.ON(STARTUP, 'amebo.middlewares.security.upsudo')
 router.ON(STARTUP, 'amebo.middlewares.security.upsecret')
 
@@ -57,12 +91,15 @@ router.GET('/v1/gists', 'amebo.controllers.gists.tabulate')
 router.POST('/v1/tokens', 'amebo.controllers.applications.authenticate')
 router.POST('/v1/actions', 'amebo.controllers.actions.insert')
 router.POST('/v1/events', 'amebo.controllers.events.insert')
+router.POST('/v1/events:batch', 'amebo.controllers.events.batch')
 router.POST('/v1/applications', 'amebo.controllers.applications.insert')
 router.POST('/v1/subscriptions', 'amebo.controllers.subscriptions.insert')
 router.POST('/v1/regists/:id', 'amebo.controllers.gists.replay')
 router.PUT('/v1/applications/:id', 'amebo.controllers.applications.update')
 
-# maybe add a route to clear cache of compiled schemas ?
+
+# prometheus scrapes
+router.GET('/metrics', 'amebo.controllers.metrics.scrape')
 
 
 # comment me out in production
@@ -0,0 +1,31 @@
+"""
+Payload compression for actions that ask for it. gzip always works, zstd needs the optional zstandard
+package i.e. pip install amebo[zstd] and falls back to gzip without it.
+"""
+from gzip import compress as gzip, decompress as gunzip
+from typing import Optional
+
+try: import zstandard
+except ImportError: zstandard = None
+
+
+GZIP, ZSTD = 'gzip', 'zstd'
+ENCODINGS = (GZIP, ZSTD)  # as named in Content-Encoding
+
+
+def encoding(wanted: Optional[str]) -> Optional[str]:
+    """the encoding an action asking for `wanted` is actually stored with"""
+    if wanted == ZSTD and zstandard is None: return GZIP
+    return wanted if wanted in ENCODINGS else None
+
+
+def compress(encoding: str, data: bytes) -> bytes:
+    if encoding == ZSTD: return zstandard.ZstdCompressor(level=3).compress(data)
+    return gzip(data, compresslevel=6, mtime=0)
+
+
+def decompress(encoding: str, data: bytes) -> bytes:
+    if encoding == ZSTD and zstandard is None:
+        raise ModuleNotFoundError('zstd payloads need the zstandard package i.e. pip install amebo[zstd]')
+    if encoding == ZSTD: return zstandard.ZstdDecompressor().decompress(data)
+    return gunzip(data)
@@ -1,24 +1,47 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from datetime import datetime, timedelta
+from hashlib import blake2b
+from typing import Optional
 from uuid import UUID, uuid5, getnode
 
 from jwt import decode, encode
-from heaven import Request
+from heaven import Request, Response
 
-from amebo.constants.literals import DEFAULT_PAGINATION
+from amebo.constants.literals import CURSOR_HEADER, DEFAULT_PAGINATION, MAX_PAGINATION
 
 
 HS256 = 'HS256'
 
 
 def get_pagination(req: Request):
-    try: page = int(req.params.get('page'))
-    except: page = 1
-    else: page = 1 if page < 0 else page
+    """the key the previous page ended on (none for the first page) and the rows to a page"""
+    after = uncursor(req.queries.get('after'))
 
-    try: pagination = int(req.params.get('pagination'))
+    try: pagination = int(req.queries.get('pagination'))
     except: pagination = DEFAULT_PAGINATION
-    else: pagination = DEFAULT_PAGINATION if pagination < 0 else pagination
-    return page, pagination
+    else: pagination = DEFAULT_PAGINATION if pagination < 1 else min(pagination, MAX_PAGINATION)
+    return after, pagination
+
+
+def cursor(key: int) -> str:
+    return urlsafe_b64encode(f'{key}'.encode()).decode().rstrip('=')
+
+
+def uncursor(token: Optional[str]) -> Optional[int]:
+    if not token: return None
+    try: return int(urlsafe_b64decode(f'{token}{"=" * (-len(token) % 4)}'.encode()))
+    except: return None
+
+
+def paginate(res: Response, rows: list, pagination: int) -> list:
+    """
+    rows are fetched one past the page, keyed by their first column, to tell whether another page follows
+    and the client is handed an opaque cursor to it i.e. ?after=<cursor>
+    """
+    if len(rows) <= pagination: return rows
+    rows = rows[:pagination]
+    res.headers = CURSOR_HEADER, cursor(rows[-1][0])
+    return rows
 
 
 def get_params(params: list, req: Request):
@@ -41,6 +64,11 @@ def get_timeline(timeline, step_or_filter, column: str = None):
     return ''
 
 
+def digest(deduper: str, payload: str) -> bytes:
+    """16 bytes standing in for an event when looking for duplicates, json payloads never hold a raw nul"""
+    return blake2b(f'{deduper}\0{payload}'.encode(), digest_size=16).digest()
+
+
 def tokenize(data, sk):
     return encode(data, sk, algorithm=HS256)
 
@@ -0,0 +1,133 @@
+"""
+Prometheus metrics kept in plain dicts and rendered in the text exposition format on scrape. Everything
+is updated from the event loop so no locks are taken, recording a sample is a dict lookup and an add.
+"""
+from bisect import bisect_left
+from typing import Dict, List, Tuple
+
+
+LATENCIES = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)  # seconds
+VALIDATIONS = (.00001, .000025, .00005, .0001, .00025, .0005, .001, .0025, .005, .01)  # seconds
+RATIOS = (.1, .2, .3, .4, .5, .6, .7, .8, .9, 1)
+
+PROMETHEUS = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(names: Tuple[str, ...], values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra: pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric(object):
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: Dict[tuple, float] = {}
+
+    def clear(self):
+        self._values.clear()
+
+    def samples(self) -> List[str]:
+        return [f'{self.name}{_labels(self.labels, labels)} {value}' for labels, value in self._values.items()]
+
+    def render(self) -> str:
+        return '\n'.join([f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}', *self.samples()])
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def set(self, value: float, *labels):
+        """for totals counted elsewhere e.g. the hits of the schema registry"""
+        self._values[labels] = value
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, *labels):
+        self._values[labels] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCIES):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        self._values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        # a count per bucket, one for +Inf and the sum, made cumulative only when rendered
+        counts = self._values.get(labels)
+        if counts is None: counts = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def samples(self) -> List[str]:
+        lines = []
+        for labels, counts in self._values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{_labels(self.labels, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labels, labels)} {counts[-1]}')
+            lines.append(f'{self.name}_count{_labels(self.labels, labels)} {cumulative}')
+        return lines
+
+
+class Metrics(object):
+    def __init__(self):
+        self._metrics: List[Metric] = []
+
+    def _register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets=LATENCIES) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def render(self) -> str:
+        return '\n'.join(metric.render() for metric in self._metrics) + '\n'
+
+
+metrics = Metrics()
+
+# ingest
+INGESTED = metrics.counter('amebo_events_total', 'Events received by action and outcome', ('action', 'outcome'))
+INGEST_SECONDS = metrics.histogram('amebo_ingest_seconds', 'Time taken to accept one event', ('action',))
+BATCH_SECONDS = metrics.histogram('amebo_ingest_batch_seconds', 'Time taken to accept a batch of events')
+VALIDATION_SECONDS = metrics.histogram(
+    'amebo_validation_seconds', 'Time taken to validate a payload against its schema', ('action',), VALIDATIONS)
+SCHEMAS = metrics.counter('amebo_schema_lookups_total', 'Schema registry lookups by result', ('result',))
+
+# dispatch
+DELIVERIES = metrics.counter('amebo_deliveries_total', 'Delivery attempts by subscription and outcome', ('subscription', 'outcome'))
+DELIVERY_SECONDS = metrics.histogram('amebo_delivery_seconds', 'Time taken by a subscriber to answer', ('subscription',))
+ENVELOPE_FILL = metrics.histogram('amebo_envelope_fill_ratio', 'Gists fetched over gists asked for', buckets=RATIOS)
+BACKLOG = metrics.gauge('amebo_backlog', 'Gists fetched by this node and waiting for a free slot')
+INFLIGHT = metrics.gauge('amebo_inflight', 'Gists this node is delivering or about to')
+PENDING = metrics.gauge('amebo_gists_pending', 'Gists not yet delivered or exhausted across the cluster')
+BREAKER_STATE = metrics.gauge('amebo_breaker_state', 'Subscriber hosts paused by this node, 1 open and 0.5 half open', ('host',))
+
+# database
+QUERY_SECONDS = metrics.histogram('amebo_query_seconds', 'Time taken by database calls', ('engine', 'statement'))
+POOL = metrics.gauge('amebo_pool_connections', 'Database connections by state', ('state',))
@@ -0,0 +1,99 @@
+from collections import OrderedDict
+from hashlib import blake2b
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from fastjsonschema import compile
+from heaven import App
+from orjson import loads
+
+from amebo.constants.literals import ACTIONS_CHANNEL, SCHEMATAS
+from amebo.decorators.providers import Executor
+
+
+class Registry(object):
+    """
+    Compiled action schemas, least recently used first out once `size` are held. Validators are keyed
+    by action and a digest of its schemata so reloading an unchanged action reuses the compiled one. The
+    compression of every loaded action is kept alongside.
+    """
+    def __init__(self, size: int):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._versions: Dict[str, str] = {}  # action -> digest of the schemata it was last loaded with
+        self._compiled: OrderedDict[Tuple[str, str], Callable] = OrderedDict()
+        self._compressions: Dict[str, Optional[str]] = {}
+
+    def __len__(self):
+        return len(self._compiled)
+
+    def get(self, action: str) -> Optional[Callable]:
+        key = (action, self._versions.get(action))
+        validator = self._compiled.get(key)
+        if validator is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._compiled.move_to_end(key)
+        return validator
+
+    def peek(self, action: str) -> Optional[Callable]:
+        """like get but neither counted nor refreshed"""
+        return self._compiled.get((action, self._versions.get(action)))
+
+    def compression(self, action: str) -> Optional[str]:
+        """as asked for by the action when it was last loaded"""
+        return self._compressions.get(action)
+
+    def put(self, action: str, schemata: str, compression: Optional[str] = None) -> Callable:
+        version = blake2b(schemata.encode(), digest_size=8).hexdigest()
+        key = (action, version)
+        validator = self._compiled.get(key)
+        if validator is None:
+            schema = loads(schemata)
+            if isinstance(schema, str): schema = loads(schema)
+            validator = compile(schema)
+        self._compiled[key] = validator
+        self._compiled.move_to_end(key)
+        self._versions[action] = version
+        self._compressions[action] = compression
+        while len(self._compiled) > self.size:
+            (evicted, digest), _ = self._compiled.popitem(last=False)
+            if self._versions.get(evicted) == digest:
+                del self._versions[evicted]
+                self._compressions.pop(evicted, None)
+        return validator
+
+    def invalidate(self, action: Optional[str] = None):
+        """the next lookup reads the schemata again, every action's when none is given"""
+        if action: self._versions.pop(action, None)
+        else: self._versions.clear()
+
+    async def load(self, executor: Executor, actions: Optional[Iterable[str]] = None):
+        """compile the schemas of the given actions in one query, or of as many actions as fit when none"""
+        x = executor.schema
+        if actions is None:
+            sqls, actions = f'SELECT action, schemata, compression FROM {x}actions LIMIT {self.size}', []
+        else:
+            actions = list(actions)
+            if not actions: return
+            placeholders = ', '.join(executor.esc(count) for count in range(1, len(actions) + 1))
+            sqls = f'SELECT action, schemata, compression FROM {x}actions WHERE action IN ({placeholders})'
+        for action, schemata, compression in await executor.fetch(2).execute(sqls, *actions) or []:
+            try: self.put(action, schemata, compression)
+            except Exception as exc: print(f'Could not compile schemata of {action}: ', exc)
+
+    async def validator(self, executor: Executor, action: str) -> Optional[Callable]:
+        """none when the action does not exist"""
+        validator = self.get(action)
+        if validator is not None: return validator
+        await self.load(executor, [action])
+        return self.peek(action)
+
+
+async def reschema(app: App, executor: Executor, action: str):
+    """call after an action's schemata changes, other nodes hear of it once the change is committed"""
+    registry: Registry = app.peek(SCHEMATAS)
+    if registry is not None: registry.invalidate(action)
+    if executor.engine.startswith('postgres'):
+        await executor.fetch(0).execute(f"SELECT pg_notify('{ACTIONS_CHANNEL}', $1);", action)
@@ -48,6 +48,12 @@ class Steps(object):
             return sqls
         return ''
 
+    def NOT_EQUALS(self, key: str, datum: any):
+        if datum is None: return ''
+        sqls = f'{"AND" if self.dirty else "WHERE"} {key} <> {self.next()}'
+        self._values.append(datum)
+        return sqls
+
     def LIKE(self, key: str, datum: any):
         if(datum):
             if(self.dirty):
@@ -58,6 +64,13 @@ class Steps(object):
             return sqls
         return ''
 
+    def AFTER(self, key: str, datum: any):
+        # keyset pagination i.e. the rows past where the previous page ended
+        if datum is None: return ''
+        sqls = f'{"AND" if self.dirty else "WHERE"} {key} > {self.next()}'
+        self._values.append(datum)
+        return sqls
+
     @property
     def dirty(self) -> bool:
         return bool(self._values)
@@ -27,6 +27,11 @@ requires = [
     'uvicorn>=0.20.0',
 ]
 
+extras = {
+    'http2': ['httpx[http2]>=0.27.0'],
+    'zstd': ['zstandard>=0.22.0'],
+}
+
 
 def get_version():
     init = open(os.path.join(ROOT, 'amebo', '__init__.py')).read()
@@ -37,6 +42,7 @@ def entry_points():
     return {
         'console_scripts': [
             'amebo = amebo:execute',
+            'amebo-bench = amebo.bench.load:execute',
         ]
     }
 
@@ -68,6 +74,7 @@ setup(
     },
     include_package_data=True,
     install_requires=requires,
+    extras_require=extras,
     license="MIT",
     python_requires=">= 3.8",
     classifiers=[
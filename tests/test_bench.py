@@ -0,0 +1,77 @@
+from gzip import compress
+from json import dumps
+from random import Random
+from time import time
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from fastjsonschema import compile
+from httpx import AsyncClient
+
+from amebo.bench.payloads import synthesize
+from amebo.bench.stats import histogram, percentile, summary
+from amebo.bench.stubs import Stub
+
+
+class TestStats(TestCase):
+    def test_percentiles_are_nearest_rank(self):
+        samples = list(range(1, 101))
+        self.assertEqual(percentile(samples, 50), 50)
+        self.assertEqual(percentile(samples, 99), 99)
+        self.assertEqual(percentile(samples, 100), 100)
+        self.assertIsNone(percentile([], 50))
+
+    def test_summary_is_in_milliseconds(self):
+        self.assertEqual(summary([0.001, 0.003])['p50'], 1)
+        self.assertEqual(summary([])['count'], 0)
+
+    def test_histogram_buckets_by_upper_bound(self):
+        counts = dict(histogram([0.001, 0.002, 20], (0.001, 0.01)))
+        self.assertEqual(counts, {'0.001': 1, '0.01': 1, '+Inf': 1})
+
+
+class TestPayloads(TestCase):
+    def test_synthesized_payloads_pass_their_schema(self):
+        schema = {
+            'type': 'object',
+            'properties': {
+                'id': {'type': 'string', 'format': 'uuid'},
+                'email': {'type': 'string', 'format': 'email'},
+                'total': {'type': 'number', 'minimum': 1, 'maximum': 500},
+                'items': {'type': 'array', 'minItems': 1, 'items': {
+                    'type': 'object',
+                    'properties': {'sku': {'type': 'string', 'minLength': 4, 'maxLength': 4}, 'qty': {'type': 'integer'}},
+                    'required': ['sku', 'qty'],
+                }},
+                'status': {'enum': ['new', 'paid']},
+                'note': {'type': ['string', 'null']},
+            },
+            'required': ['id', 'email', 'total', 'items', 'status'],
+            'additionalProperties': False,
+        }
+        validate, random = compile(schema), Random(7)
+        for _ in range(50): validate(synthesize(schema, random))
+
+
+class TestStub(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.stub = await Stub().start()
+        self.url = f'http://127.0.0.1:{self.stub.port}/hook'
+
+    async def asyncTearDown(self):
+        await self.stub.stop()
+
+    async def test_counts_each_event_once(self):
+        async with AsyncClient() as client:
+            for _ in range(2): await client.post(self.url, json={'i': 1, 't': time()})
+            await client.post(self.url, json=[{'i': 2, 't': time()}, {'i': 3, 't': time()}])
+            body = compress(dumps({'i': 4, 't': time()}).encode())
+            await client.post(self.url, content=body, headers={'content-encoding': 'gzip'})
+        self.assertEqual(self.stub.requests, 4)
+        self.assertEqual(sorted(self.stub.latencies), [1, 2, 3, 4])
+
+    async def test_failures_are_not_delivered(self):
+        self.stub.failures = 1
+        async with AsyncClient() as client:
+            response = await client.post(self.url, json={'i': 1, 't': time()})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual((self.stub.failed, self.stub.delivered), (1, 0))
@@ -0,0 +1,48 @@
+from unittest import TestCase
+
+from amebo.dispatch.batches import fill
+from amebo.dispatch.retries import backoff
+from amebo.utils.compression import GZIP, compress, decompress
+
+
+class TestBackoff(TestCase):
+    def test_delays_grow_to_the_cap(self):
+        self.assertEqual(backoff(0, 1, 2, 300, 0), 1)
+        self.assertEqual(backoff(3, 1, 2, 300, 0), 8)
+        self.assertEqual(backoff(20, 1, 2, 300, 0), 300)
+
+    def test_float_policies_do_not_overflow(self):
+        # as read back from the REAL columns, with retries up to what the model allows
+        self.assertEqual(backoff(1100, 1.0, 2.0, 300.0, 0), 300.0)
+        self.assertEqual(backoff(160, 1.0, 100.0, 300.0, 0), 300.0)
+        self.assertEqual(backoff(10_000, 1, 100, 300, 0), 300)
+        self.assertLessEqual(backoff(10_000, 1.0, 100.0, 300.0, 0.2), 300.0)
+        self.assertGreaterEqual(backoff(10_000, 1.0, 100.0, 300.0, 0.2), 240.0)
+
+
+class TestFill(TestCase):
+    def setUp(self):
+        # gists as fetched (gist, subscription, retries, payload, ordered, encoding) of a compressed action
+        self.payload = b'{"note": "' + b'a' * 1000 + b'"}'
+        self.backlog = {gid: (gid, 1, 0, compress(GZIP, self.payload), False, GZIP) for gid in range(2, 8)}
+        self.backlog[8] = (8, 2, 0, b'{}', False, None)
+        self.first = (1, self.payload, 0, False, None)
+
+    def deliverable(self, gist: tuple):
+        gid, _, retries, payload, _, encoding = gist
+        if retries: return None  # as if exhausted
+        return gid, decompress(encoding, payload) if encoding else payload, 0, False, None
+
+    def test_compressed_payloads_are_measured_decompressed(self):
+        self.assertLess(len(self.backlog[2][3]), 100)
+        gists = fill(self.backlog, 1, self.first, 10, 3500, self.deliverable)
+        self.assertEqual([gist[0] for gist in gists], [1, 2, 3])
+        self.assertLessEqual(sum(len(gist[1]) + 1 for gist in gists) - 1, 3500)
+        # those left out wait in the backlog, in order
+        self.assertEqual(list(self.backlog), [4, 5, 6, 7, 8])
+
+    def test_dropped_gists_are_not_counted(self):
+        self.backlog[2] = (2, 1, 5, b'', False, None)
+        gists = fill(self.backlog, 1, self.first, 10, 3500, self.deliverable)
+        self.assertEqual([gist[0] for gist in gists], [1, 3, 4])
+        self.assertNotIn(2, self.backlog)
@@ -0,0 +1,64 @@
+from os import environ
+from sqlite3 import Connection
+from unittest import IsolatedAsyncioTestCase, TestCase, skipUnless
+
+from amebo.constants.scripts import initdbscript
+from amebo.database.pg import pgscript
+from amebo.dispatch.queries import claimscript, pendingscript
+
+
+LOOKUPS = {
+    'subscriptions_action': ('SELECT subscription FROM {x}subscriptions WHERE action = {p}', 'user.created'),
+    'events_action': ('SELECT event FROM {x}events WHERE action = {p}', 'user.created'),
+    'gists_subscription': ('SELECT rowid FROM {x}gists WHERE subscription = {p}', 1),
+}
+
+
+class TestSqliteIndexes(TestCase):
+    def setUp(self):
+        self.db = Connection(':memory:')
+        self.db.executescript(initdbscript)
+
+    def tearDown(self):
+        self.db.close()
+
+    def explain(self, sqls: str, *args) -> str:
+        return '\n'.join(row[-1] for row in self.db.execute(f'EXPLAIN QUERY PLAN {sqls}', args))
+
+    def test_pending_gists_use_partial_index(self):
+        plan = self.explain(pendingscript(''), '2024-01-01T00:00:00', 10)
+        self.assertIn('gists_pending', plan)
+        self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plan)
+
+    def test_lookups_use_indexes(self):
+        for index, (sqls, arg) in LOOKUPS.items():
+            with self.subTest(index=index):
+                self.assertIn(index, self.explain(sqls.format(x='', p='?'), arg))
+
+
+@skipUnless(environ.get('AMEBO_TEST_DSN'), 'set AMEBO_TEST_DSN to check postgres query plans')
+class TestPostgresIndexes(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        from asyncpg import connect
+        self.db = await connect(environ.get('AMEBO_TEST_DSN'))
+        # everything is rolled back so the check never touches an existing amebo schema
+        self.transaction = self.db.transaction()
+        await self.transaction.start()
+        await self.db.execute(pgscript)
+        # empty tables are cheaper to scan than to index, only whether an index is usable matters here
+        await self.db.execute('SET LOCAL enable_seqscan = off')
+
+    async def asyncTearDown(self):
+        await self.transaction.rollback()
+        await self.db.close()
+
+    async def explain(self, sqls: str, *args) -> str:
+        return '\n'.join(row[0] for row in await self.db.fetch(f'EXPLAIN {sqls}', *args))
+
+    async def test_claim_uses_partial_index(self):
+        self.assertIn('gists_pending', await self.explain(claimscript('_amebo_.'), 'node', 10, 60.0))
+
+    async def test_lookups_use_indexes(self):
+        for index, (sqls, arg) in LOOKUPS.items():
+            with self.subTest(index=index):
+                self.assertIn(index, await self.explain(sqls.format(x='_amebo_.', p='$1'), arg))